@@ -0,0 +1,148 @@
+from collections import OrderedDict
+import functools
+import inspect
+import pickle
+import os
+
+
+class ResultCache:
+    def __init__(self, max_size=1024, precision=4, path=None):
+        """
+        Least-recently-used cache of finder results, keyed by method, coin set and ratios rounded to a number of
+        decimals, so queries with nearly identical ratios share their result. Results are shared objects, they
+        should not be changed by the caller.
+
+        Parameters
+        ----------
+        max_size: int
+            Maximum number of results, the least recently used one is dropped first
+
+        precision: int
+            Number of decimals the ratios are rounded to
+
+        path: str
+            Optional pickle file, loaded by self.bind() and written by self.save()
+        """
+        self.max_size = max_size
+        self.precision = precision
+        self.path = path
+
+        self.results = OrderedDict()
+        self.fingerprint = None
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.results)
+
+    def __repr__(self):
+        return f"ResultCache ({len(self)}/{self.max_size} results, {self.hits} hits, {self.misses} misses)"
+
+    def __str__(self):
+        return self.__repr__()
+
+    def key(self, method, ratios, arguments):
+        """
+        Cache key of a query
+
+        Parameters
+        ----------
+        method: str
+            Name of the finder method
+
+        ratios: dict
+            Maps crypto names to steak percentage
+
+        arguments: dict
+            Other arguments changing the result, e.g. eps or k
+        """
+        return (method, tuple(sorted((c, round(r, self.precision)) for c, r in ratios.items())),
+                tuple(sorted(arguments.items())))
+
+    def get(self, key):
+        """
+        Returns the result of a query, raises KeyError if it is not cached
+        """
+        try:
+            result = self.results[key]
+        except KeyError:
+            self.misses += 1
+            raise
+
+        self.results.move_to_end(key)
+        self.hits += 1
+        return result
+
+    def put(self, key, result):
+        self.results[key] = result
+        self.results.move_to_end(key)
+        while len(self.results) > self.max_size:
+            self.results.popitem(last=False)
+
+    def clear(self):
+        self.results.clear()
+
+    def bind(self, fingerprint):
+        """
+        Ties the cache to the balances it was computed from. Results of other balances are dropped, and the results
+        stored in self.path are loaded if they belong to these balances.
+
+        Parameters
+        ----------
+        fingerprint: tuple
+            Summary of the balances, see Finder.fingerprint()
+        """
+        if fingerprint == self.fingerprint:
+            return
+
+        self.clear()
+        self.fingerprint = fingerprint
+        if self.path is None or not os.path.exists(self.path):
+            return
+
+        with open(self.path, 'rb') as handle:
+            stored = pickle.load(handle)
+        if stored['fingerprint'] == fingerprint:
+            for key, result in stored['results']:
+                self.put(key, result)
+
+    def save(self):
+        """
+        Writes the results to self.path
+        """
+        if self.path is None:
+            raise ValueError('ResultCache has no path to save to')
+
+        with open(self.path, 'wb') as handle:
+            output_dict = {'fingerprint': self.fingerprint, 'results': list(self.results.items())}
+            pickle.dump(output_dict, handle, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def cached_result(*ignored):
+    """
+    Decorator of the Finder methods taking ratios: the result is looked up in self.cache first, if the Finder has
+    one. Arguments that do not change the result, e.g. the number of workers, are left out of the key.
+    """
+    def decorator(method):
+        signature = inspect.signature(method)
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if self.cache is None:
+                return method(self, *args, **kwargs)
+
+            bound = signature.bind(self, *args, **kwargs)
+            bound.apply_defaults()
+            arguments = {name: value for name, value in bound.arguments.items()
+                         if name not in ('self', 'ratios') + ignored}
+            key = self.cache.key(method.__name__, bound.arguments['ratios'], arguments)
+
+            try:
+                return self.cache.get(key)
+            except KeyError:
+                result = method(self, *args, **kwargs)
+                self.cache.put(key, result)
+                return result
+
+        return wrapper
+    return decorator
@@ -1,3 +1,5 @@
+from collections.abc import Mapping
+import numpy as np
 import statistics
 
 
@@ -56,49 +58,82 @@ class FinderAccount:
         return self.cl / self.voters
 
 
+def group_scores(scores, groups, n):
+    """
+    Average and sample variance of the scores of each group, like custom_mean() and custom_var() but for many
+    groups at once.
+
+    Parameters
+    ----------
+    scores: numpy.ndarray
+        Scores
+
+    groups: numpy.ndarray
+        Group of each score, in [0, n)
+
+    n: int
+        Number of groups
+
+    Returns
+    -------
+    (averages, variances, counts): tuple
+        One value per group, 0 for groups too small to have one, and the number of scores of each group. The sums
+        are not exact like those of the statistics module, so averages and variances of groups with more than one
+        score may differ from custom_mean() and custom_var() in the last bits.
+    """
+    counts = np.bincount(groups, minlength=n)
+    averages = np.bincount(groups, weights=scores, minlength=n) / np.maximum(counts, 1)
+    deviations = np.bincount(groups, weights=(scores - averages[groups]) ** 2, minlength=n)
+    variances = np.where(counts > 1, deviations / np.maximum(counts - 1, 1), 0.0)
+    return averages, variances, counts
+
+
+def ranking_key(averages, variances):
+    """
+    Immutable key ordering answers like FinderAnswer: higher averages first, then lower variances
+    """
+    return tuple(averages), tuple(-v for v in variances)
+
+
 class FinderAnswer:
-    def __init__(self, dictionary):
+    def __init__(self, dictionary, key=None):
+        """
+        Answer of Finder.find(): maps each crypto name to its list of FinderAccount(). The ranking key is computed
+        once, so the accounts should not be changed afterwards.
+
+        Parameters
+        ----------
+        dictionary: dict
+            Maps crypto names to lists of FinderAccount()
+
+        key: tuple
+            Precomputed ranking_key() of custom_mean() and custom_var() of the scores of each crypto
+        """
         self.d = dictionary
+        if key is None:
+            scores = [[acc.get_score() for acc in arr] for arr in dictionary.values()]
+            key = ranking_key([custom_mean(s) for s in scores], [custom_var(s) for s in scores])
+        self.key = key
 
     def __eq__(self, other):
         if isinstance(other, FinderAnswer):
-            a1, v1 = self.get_score()
-            a2, v2 = other.get_score()
-            return a1 == a2 and v1 == v2
+            return self.key == other.key
 
     def __lt__(self, other):
         if isinstance(other, FinderAnswer):
-            a1, v1 = self.get_score()
-            a2, v2 = other.get_score()
-            if a1 < a2:
-                return True
-            elif a1 == a2:
-                return v1 > v2
-            else:
-                return False
+            return self.key < other.key
 
     def __le__(self, other):
         if isinstance(other, FinderAnswer):
-            a1, v1 = self.get_score()
-            a2, v2 = other.get_score()
-            return a1 <= a2
+            return self.key <= other.key
 
     def __ge__(self, other):
         if isinstance(other, FinderAnswer):
-            a1, v1 = self.get_score()
-            a2, v2 = other.get_score()
-            return a1 >= a2
+            return self.key >= other.key
 
     def __gt__(self, other):
         if isinstance(other, FinderAnswer):
-            a1, v1 = self.get_score()
-            a2, v2 = other.get_score()
-            if a1 > a2:
-                return True
-            elif a1 == a2:
-                return v1 < v2
-            else:
-                return False
+            return self.key > other.key
 
     def __str__(self):
         a, v = self.get_score()
@@ -108,9 +143,8 @@ class FinderAnswer:
         return self.__str__()
 
     def get_score(self):
-        averages = [custom_mean([acc.get_score() for acc in arr]) for arr in self.d.values()]
-        variances = [custom_var([acc.get_score() for acc in arr]) for arr in self.d.values()]
-        return averages, variances
+        averages, negated = self.key
+        return list(averages), [-v for v in negated]
 
 
 class FinderAnswerPaper:
@@ -158,3 +192,388 @@ class FinderAnswerPaper:
         m = len(self.alpha.keys())
         bsum = sum(a.balance for a in self.d.values())
         return m - sum(abs(self.alpha[key] - self.d[key].balance / bsum) for key in self.d.keys())
+
+
+def owner_offsets(owner_ids):
+    """
+    Returns the distinct owners of sorted owner ids and the offsets of their rows, the rows of owners[i] being
+    offsets[i]:offsets[i + 1]
+    """
+    starts = np.flatnonzero(np.diff(owner_ids, prepend=owner_ids[:1] - 1))
+    return owner_ids[starts], np.append(starts, len(owner_ids))
+
+
+class SyntheticUsers(Mapping):
+    def __init__(self, owner_ids, coin_codes, balances, account_ids, coins):
+        """
+        Funded accounts grouped by owner, kept as parallel arrays sorted by owner id. Behaves as a read-only
+        dictionary mapping each owner id to a list of (crypto_type, balance, account_id) tuples.
+
+        Parameters
+        ----------
+        owner_ids: numpy.ndarray
+            Owner id of each account
+
+        coin_codes: numpy.ndarray
+            Index in coins of the crypto type of each account
+
+        balances: numpy.ndarray
+            Balance of each account
+
+        account_ids: numpy.ndarray
+            Id of each account
+
+        coins: list
+            Crypto names
+        """
+        order = np.lexsort((account_ids, owner_ids))
+        self.owner_ids = owner_ids[order]
+        self.coin_codes = coin_codes[order]
+        self.balances = balances[order]
+        self.account_ids = account_ids[order]
+        self.coins = list(coins)
+
+        self.owners, self.offsets = owner_offsets(self.owner_ids)
+
+    def __getitem__(self, owner_id):
+        i = np.searchsorted(self.owners, owner_id)
+        if i >= len(self.owners) or self.owners[i] != owner_id:
+            raise KeyError(owner_id)
+
+        rows = slice(self.offsets[i], self.offsets[i + 1])
+        return [(self.coins[c], b, a) for c, b, a in zip(self.coin_codes[rows].tolist(), self.balances[rows].tolist(),
+                                                         self.account_ids[rows].tolist())]
+
+    def __iter__(self):
+        return iter(self.owners.tolist())
+
+    def __len__(self):
+        return len(self.owners)
+
+    def __repr__(self):
+        return f"SyntheticUsers ({len(self)} users, {len(self.account_ids)} accounts)"
+
+    def __str__(self):
+        return self.__repr__()
+
+    def update(self, owner_ids, coin_codes, balances, account_ids):
+        """
+        Sets the balance of the given accounts, keeping the arrays sorted without sorting them again. Accounts whose
+        balance is not positive are removed, unknown funded accounts are added.
+
+        Parameters
+        ----------
+        owner_ids, coin_codes, balances, account_ids: numpy.ndarray
+            Same as in the constructor, account ids must be unique
+        """
+        size = int(max(self.account_ids.max(initial=0), account_ids.max(initial=0))) + 1
+        keys = self.owner_ids * size + self.account_ids
+        new_keys = owner_ids * size + account_ids
+
+        position = np.searchsorted(keys, new_keys)
+        found = position < len(keys)
+        found[found] = keys[position[found]] == new_keys[found]
+        funded = balances > 0
+
+        self.balances[position[found & funded]] = balances[found & funded]
+
+        keep = np.ones(len(keys), dtype=bool)
+        keep[position[found & ~funded]] = False
+        added = np.flatnonzero(~found & funded)
+        added = added[np.argsort(new_keys[added])]
+        position = np.searchsorted(keys[keep], new_keys[added])
+
+        self.owner_ids = np.insert(self.owner_ids[keep], position, owner_ids[added])
+        self.coin_codes = np.insert(self.coin_codes[keep], position, coin_codes[added])
+        self.balances = np.insert(self.balances[keep], position, balances[added])
+        self.account_ids = np.insert(self.account_ids[keep], position, account_ids[added])
+        self.owners, self.offsets = owner_offsets(self.owner_ids)
+
+
+def neighbour_ranges(values, targets):
+    """
+    Batch version of BlockSim.finder.finder.binary_find() over sorted values.
+
+    For each target, the range covers all values equal to the target or, without an exact match, the nearest value
+    below and the nearest value above, ties included. Targets outside [values[0], values[-1]] get an empty range.
+
+    Parameters
+    ----------
+    values: numpy.ndarray
+        Sorted values
+
+    targets: array_like
+        Target values
+
+    Returns
+    -------
+    (start, stop): tuple
+        Arrays such that values[start[i]:stop[i]] are the matches of targets[i]
+    """
+    targets = np.asarray(targets, dtype=np.float64)
+    if len(values) < 1:
+        empty = np.zeros(targets.shape, dtype=np.int64)
+        return empty, empty
+
+    left = np.searchsorted(values, targets, side='left')
+    right = np.searchsorted(values, targets, side='right')
+
+    exact = right > left
+    inside = (left > 0) & (left < len(values))
+
+    below = values[np.maximum(left - 1, 0)]
+    above = values[np.minimum(left, len(values) - 1)]
+    start = np.where(exact, left, np.searchsorted(values, below, side='left'))
+    stop = np.where(exact, right, np.searchsorted(values, above, side='right'))
+
+    found = exact | inside
+    return np.where(found, start, 0), np.where(found, stop, 0)
+
+
+def tolerance_ranges(values, targets, eps):
+    """
+    For each target, the range of the sorted values within a relative tolerance eps, i.e. in
+    [target * (1 - eps), target * (1 + eps)].
+
+    Returns
+    -------
+    (start, stop): tuple
+        Arrays such that values[start[i]:stop[i]] are the matches of targets[i]
+    """
+    targets = np.asarray(targets, dtype=np.float64)
+    margin = np.abs(targets) * eps
+    return (np.searchsorted(values, targets - margin, side='left'),
+            np.searchsorted(values, targets + margin, side='right'))
+
+
+def nearest_ranges(values, targets, k, start=None, stop=None):
+    """
+    For each target, the range of the k sorted values nearest to it. In one dimension, the nearest values are
+    contiguous, so the range is found by a binary search over the position of a window of k values.
+
+    Parameters
+    ----------
+    values: numpy.ndarray
+        Sorted values
+
+    targets: array_like
+        Target values
+
+    k: int
+        Number of values per target
+
+    start, stop: numpy.ndarray
+        Optional bounds, the values are then taken from values[start[i]:stop[i]] only
+
+    Returns
+    -------
+    (start, stop): tuple
+        Arrays such that values[start[i]:stop[i]] are the min(k, stop[i] - start[i]) values nearest to targets[i]
+    """
+    targets = np.asarray(targets, dtype=np.float64)
+    start = np.zeros(targets.shape, dtype=np.int64) if start is None else np.asarray(start, dtype=np.int64)
+    stop = np.full(targets.shape, len(values), dtype=np.int64) if stop is None else np.asarray(stop, dtype=np.int64)
+
+    size = np.minimum(k, stop - start)
+    position = np.clip(np.searchsorted(values, targets), start, stop)
+    lo = np.clip(position - size, start, stop - size)
+    hi = np.clip(position, start, stop - size)
+
+    # Move the window right while its first value is farther from the target than the value just after it
+    active = np.flatnonzero(lo < hi)
+    while len(active) > 0:
+        mid = (lo[active] + hi[active]) // 2
+        right = targets[active] - values[mid] > values[mid + size[active]] - targets[active]
+        lo[active] = np.where(right, mid + 1, lo[active])
+        hi[active] = np.where(right, hi[active], mid)
+        active = active[lo[active] < hi[active]]
+
+    return lo, lo + size
+
+
+class SortedBalances:
+    def __init__(self, ids, balances):
+        """
+        Accounts of one coin sorted by balance (then by id), kept as NumPy arrays for batch lookups.
+
+        Parameters
+        ----------
+        ids: array_like
+            Account ids
+
+        balances: array_like
+            Balance of each account
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        balances = np.asarray(balances, dtype=np.float64)
+
+        order = np.lexsort((ids, balances))
+        self.ids = ids[order]
+        self.balances = balances[order]
+
+    @classmethod
+    def from_dict(cls, balances):
+        """
+        Builds the index from a dictionary mapping account ids to balances, such as Finder.balances[coin]
+        """
+        return cls(np.fromiter(balances.keys(), dtype=np.int64, count=len(balances)),
+                   np.fromiter(balances.values(), dtype=np.float64, count=len(balances)))
+
+    @classmethod
+    def from_sorted(cls, ids, balances):
+        """
+        Wraps arrays that are already sorted, e.g. loaded from a file, without sorting them again
+        """
+        index = cls.__new__(cls)
+        index.ids, index.balances = ids, balances
+        return index
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __repr__(self):
+        return f"SortedBalances ({len(self)} accounts)"
+
+    def update(self, ids, balances):
+        """
+        Sets the balance of the given accounts, keeping the index sorted without sorting it again. Accounts whose
+        balance is not positive are removed, unknown funded accounts are added.
+
+        Parameters
+        ----------
+        ids: array_like
+            Unique account ids
+
+        balances: array_like
+            New balance of each account
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        balances = np.asarray(balances, dtype=np.float64)
+
+        keep = ~np.isin(self.ids, ids)
+        kept_ids, kept_balances = self.ids[keep], self.balances[keep]
+
+        funded = balances > 0
+        ids, balances = ids[funded], balances[funded]
+        order = np.lexsort((ids, balances))
+        ids, balances = ids[order], balances[order]
+
+        position = np.searchsorted(kept_balances, balances, side='left')
+        stop = np.searchsorted(kept_balances, balances, side='right')
+        # Equal balances are sorted by id
+        for i in np.flatnonzero(stop > position).tolist():
+            position[i] += np.searchsorted(kept_ids[position[i]:stop[i]], ids[i])
+
+        self.ids = np.insert(kept_ids, position, ids)
+        self.balances = np.insert(kept_balances, position, balances)
+
+    def __str__(self):
+        return self.__repr__()
+
+    def lookup(self, targets, eps=None, k=None):
+        """
+        Finds the matching accounts of each target in O(log n) per target.
+
+        Parameters
+        ----------
+        targets: array_like
+            Target balances
+
+        eps: float
+            Relative tolerance, see tolerance_ranges(). By default, the accounts with a balance equal to the
+            target or else nearest on both sides are matched, see neighbour_ranges().
+
+        k: int
+            Keep only the k matches nearest to the target. Without eps, these are the k nearest accounts.
+
+        Returns
+        -------
+        (start, stop): tuple
+            Arrays such that self.ids[start[i]:stop[i]] are the matches of targets[i]
+        """
+        if eps is not None:
+            start, stop = tolerance_ranges(self.balances, targets, eps)
+        elif k is not None:
+            start, stop = None, None
+        else:
+            return neighbour_ranges(self.balances, targets)
+
+        if k is not None:
+            start, stop = nearest_ranges(self.balances, targets, k, start, stop)
+
+        return start, stop
+
+
+class Candidates:
+    __slots__ = ('roots', 'positions', 'cl', 'voters')
+
+    def __init__(self, roots, positions, cl, voters):
+        """
+        Candidate accounts of one coin level of the reverse finder, as parallel arrays sorted by root. Each row
+        is the FinderAccount() found for a root account, without building the object.
+
+        Parameters
+        ----------
+        roots: numpy.ndarray
+            Position of the root account in the index of the first coin
+
+        positions: numpy.ndarray
+            Position of the candidate account in the index of this coin, see SortedBalances()
+
+        cl: numpy.ndarray
+            Confidence level
+
+        voters: numpy.ndarray
+            Number of accounts of the previous level that voted for the candidate
+        """
+        self.roots = roots
+        self.positions = positions
+        self.cl = cl
+        self.voters = voters
+
+    def __len__(self):
+        return len(self.roots)
+
+    def scores(self):
+        """
+        Returns FinderAccount.get_score() of every candidate
+        """
+        return np.where(self.voters < 1, self.cl, self.cl / np.maximum(self.voters, 1))
+
+    def bounds(self, roots):
+        """
+        Returns (start, stop) such that the candidates of roots[i] are the rows start[i]:stop[i]
+
+        Parameters
+        ----------
+        roots: numpy.ndarray
+            Sorted root positions
+        """
+        return np.searchsorted(self.roots, roots, side='left'), np.searchsorted(self.roots, roots, side='right')
+
+    def select(self, roots):
+        """
+        Returns the candidates of the given roots only
+        """
+        rows = np.isin(self.roots, roots)
+        return Candidates(self.roots[rows], self.positions[rows], self.cl[rows], self.voters[rows])
+
+    def accounts(self, index, rows):
+        """
+        Builds the FinderAccount() of the given rows
+
+        Parameters
+        ----------
+        index: SortedBalances()
+            Index of the coin of this level
+
+        rows: slice
+            Rows to build
+        """
+        accounts = []
+        for position, cl, voters in zip(self.positions[rows].tolist(), self.cl[rows].tolist(),
+                                        self.voters[rows].tolist()):
+            acc = FinderAccount(float(index.balances[position]), int(index.ids[position]))
+            acc.cl, acc.voters = cl, voters
+            accounts.append(acc)
+        return accounts
@@ -1,11 +1,20 @@
-from BlockSim.orm.database import Account, Database, Transaction, User
-from BlockSim.finder.classes import FinderAccount, FinderAnswer, FinderAnswerPaper
+from BlockSim.orm.database import Account, BalanceCheckpoint, Database, Transaction, User
+from BlockSim.simulator.simulator import round_balances
+from BlockSim.finder.cache import cached_result
+from BlockSim.finder.neighbours import ShareIndex
+from BlockSim.settings import fork_context
+from BlockSim.finder.classes import Candidates, FinderAccount, FinderAnswer, FinderAnswerPaper, SortedBalances, \
+    SyntheticUsers, custom_mean, custom_var, group_scores, nearest_ranges, neighbour_ranges, ranking_key
 from collections import defaultdict, OrderedDict
 from tqdm import tqdm
+import sqlalchemy as sa
+import numpy as np
 import warnings
 import itertools
-import copy
+import heapq
+import multiprocessing
 import pickle
+import os
 
 
 def binary_find(balance, all_balances):
@@ -23,7 +32,7 @@ def binary_find(balance, all_balances):
     Returns
     -------
     l: list
-        List of accounts of tuples (balance_c, id_c)
+        Accounts with a balance equal to the target or, without an exact match, the nearest ones on both sides
     """
     if not isinstance(balance, FinderAccount):
         return TypeError("balance should be an instance of BlockSim.finder.classes.FinderAccount()")
@@ -31,73 +40,294 @@ def binary_find(balance, all_balances):
     if not isinstance(all_balances, list) or not all(isinstance(x, FinderAccount) for x in all_balances):
         return TypeError("all_balances is a list of balances of type BlockSim.finder.classes.FinderAccount()")
 
-    left_idx, right_idx = 0, len(all_balances) - 1
-
-    if all_balances > balance or all_balances[-1] < balance:
-        return []
-
-    while right_idx > left_idx:
-        index = (right_idx + left_idx) // 2
-        sub = all_balances[index]
-
-        # Found on left
-        if all_balances[left_idx] == balance:
-            i, ind = left_idx, []
-            while i <= right_idx and all_balances[i] == balance:
-                ind.append(i)
-                i += 1
-            return [all_balances[i] for i in ind]
-
-        # Found on middle
-        elif sub == balance:
-            i, j, ind = index, index + 1, []
-
-            while i >= left_idx and all_balances[i] == balance:
-                ind.append(i)
-                i -= 1
-
-            while j <= right_idx and all_balances[j] == balance:
-                ind.append(j)
-                j += 1
-
-            return [all_balances[i] for i in ind]
-
-        # Found on right
-        elif all_balances[right_idx] == balance:
-            i, ind = right_idx, []
-            while i >= left_idx and all_balances[i] == balance:
-                ind.append(i)
-                i -= 1
-            return [all_balances[i] for i in ind]
-
-        elif sub > balance:
-            if right_idx == index:
-                indices = sorted([right_idx, left_idx])
-                return [all_balances[ind] for ind in indices]
-            right_idx = index
-        else:
-            if left_idx == index:
-                indices = sorted([right_idx, left_idx])
-                return [all_balances[ind] for ind in indices]
-            left_idx = index
+    values = np.array([acc.balance for acc in all_balances], dtype=np.float64)
+    start, stop = neighbour_ranges(values, [balance.balance])
+    return all_balances[start[0]:stop[0]]
 
-    indices = sorted([right_idx, left_idx])
-    i, j = indices[0] - 1, indices[1] + 1
-    v1, v2 = all_balances[indices[0] - 1], all_balances[indices[1] + 1]
 
-    while i >= 0 and all_balances[i] == v1:
-        indices.append(i)
-        i -= 1
+def confidence_level(target, value):
+    return max(0.0, 1 - abs(value - target) / target)
 
-    while j < len(all_balances) and all_balances[j] == v2:
-        indices.append(j)
-        j += 1
 
-    return [all_balances[i] for i in indices]
+def expand_candidates(index, candidates, targets, eps=None, k=None):
+    """
+    Looks up the targets of a level of candidates in the index of the next coin, in the order of
+    Finder.find(): matches of the first candidate first, each in index order.
 
+    Parameters
+    ----------
+    index: BlockSim.finder.classes.SortedBalances()
+        Index of the next coin
 
-def confidence_level(target, value):
-    return max(0.0, 1 - abs(value - target) / target)
+    candidates: BlockSim.finder.classes.Candidates()
+        Candidates of the previous coin
+
+    targets: numpy.ndarray
+        Target balance of each candidate
+
+    eps, k:
+        See BlockSim.finder.classes.SortedBalances.lookup()
+
+    Returns
+    -------
+    candidates: BlockSim.finder.classes.Candidates()
+        Candidates of the next coin, merged per root and account in order of first occurrence
+    """
+    starts, stops = index.lookup(targets, eps=eps, k=k)
+    counts = stops - starts
+
+    sources = np.repeat(np.arange(len(targets)), counts)
+    positions = np.arange(counts.sum()) + np.repeat(starts - (np.cumsum(counts) - counts), counts)
+
+    # Same operations as confidence_level(), element-wise
+    t = targets[sources]
+    cl = candidates.cl[sources] * np.maximum(0.0, 1 - np.abs(index.balances[positions] - t) / t)
+
+    found = cl > 0.0
+    roots, positions, cl = candidates.roots[sources[found]], positions[found], cl[found]
+
+    # Merge the votes for the same account of the same root. The sums are done in occurrence order, like +=
+    _, first, inverse = np.unique(roots * len(index) + positions, return_index=True, return_inverse=True)
+    order = np.argsort(first, kind='stable')
+    group = np.empty(len(order), dtype=np.int64)
+    group[order] = np.arange(len(order))
+    group = group[inverse.ravel()]
+
+    return Candidates(roots[first[order]], positions[first[order]],
+                      np.bincount(group, weights=cl, minlength=len(order)),
+                      np.bincount(group, minlength=len(order)))
+
+
+# Rounding margin of the bounds of Finder.find_top(), a sum of n products <= x divided by n may round above x
+SLACK = 1 + 1e-9
+
+# Rounding margin of the batch scores of score_roots(), relative to max(1, |score|). Sums of n scores differ from the
+# exact ones of the statistics module by about n * 1e-16.
+MARGIN = 1e-9
+
+
+def nearest_confidence(index, targets):
+    """
+    Returns the confidence level of the account nearest to each target, 0.0 for an empty index. It is an upper
+    bound of the confidence level of every account matched by index.lookup().
+    """
+    if len(index) < 1:
+        return np.zeros(len(targets))
+
+    start, _ = nearest_ranges(index.balances, targets, 1)
+    return np.maximum(0.0, 1 - np.abs(index.balances[start] - targets) / targets)
+
+
+def score_roots(levels, roots):
+    """
+    Scores the answers of many roots at once, see BlockSim.finder.classes.group_scores()
+
+    Parameters
+    ----------
+    levels: list
+        BlockSim.finder.classes.Candidates() of each coin
+
+    roots: numpy.ndarray
+        Sorted root positions
+
+    Returns
+    -------
+    (averages, variances, margins): tuple
+        Arrays with one row per root and one column per coin. The exact averages and variances of
+        BlockSim.finder.classes.FinderAnswer() are within margins of them.
+    """
+    scores = [group_scores(level.scores(), np.searchsorted(roots, level.roots), len(roots)) for level in levels]
+    averages = np.column_stack([a for a, _, _ in scores])
+    variances = np.column_stack([v for _, v, _ in scores])
+
+    # A single score is its own average, with a variance of 0, exactly
+    counts = np.column_stack([c for _, _, c in scores])
+    margins = np.where(counts > 1, MARGIN * np.maximum(1.0, np.maximum(averages, variances)), 0.0)
+    return averages, variances, margins
+
+
+def exact_keys(levels, roots):
+    """
+    Returns the ranking key of FinderAnswer() of each root, scored with custom_mean() and custom_var()
+    """
+    rows = [level.bounds(roots) for level in levels]
+    scores = [level.scores().tolist() for level in levels]
+
+    keys = []
+    for i in range(len(roots)):
+        groups = [s[start[i]:stop[i]] for s, (start, stop) in zip(scores, rows)]
+        keys.append(ranking_key([custom_mean(g) for g in groups], [custom_var(g) for g in groups]))
+    return keys
+
+
+def lex_below(rows, target):
+    """
+    Returns whether each row is lexicographically below target: the first column where they differ decides
+    """
+    differs = rows != target
+    first = np.argmax(differs, axis=1)
+    return differs.any(axis=1) & (rows[np.arange(len(rows)), first] < target[first])
+
+
+def prune_chunk(levels, roots, averages):
+    """
+    Returns the roots whose partial chain may still rank at or above the given exact averages: upper bounds of the
+    averages of the expanded coins, then the largest confidence level of the last one as a bound of the next average.
+    """
+    last = levels[-1]
+    start, stop = last.bounds(roots)
+    largest = np.zeros(len(roots))
+    found = stop > start
+    if len(last) > 0:
+        largest[found] = np.maximum.reduceat(last.cl, start[found])
+
+    batch, _, margins = score_roots(levels, roots)
+    bounds = np.column_stack([batch + margins, largest * SLACK])
+    return roots[~lex_below(bounds, np.array(averages[:bounds.shape[1]], dtype=np.float64))]
+
+
+def scan_roots(indexes, ratios, order, bound, top, eps=None, k=None, chunk_size=10000, progress=None):
+    """
+    Branch and bound of Finder.find_top() over the given roots.
+
+    Parameters
+    ----------
+    indexes: collections.OrderedDict
+        BlockSim.finder.classes.SortedBalances() of each coin, in search order
+
+    ratios: dict
+        Maps crypto names to steak percentage
+
+    order: numpy.ndarray
+        Root positions, by decreasing bound
+
+    bound: numpy.ndarray
+        Upper bound of the average score of the second coin of every root
+
+    top, eps, k, chunk_size:
+        See Finder.find_top()
+
+    progress: tqdm.tqdm
+        Optional progress bar, updated with the number of scanned roots
+
+    Returns
+    -------
+    (best, stats): tuple
+        Sorted list of (key, -root, answer) of the top best answers, and the number of expanded candidates and
+        pruned roots. Answers are ranked by the exact key of FinderAnswer(), the first root winning ties, like an
+        exhaustive scan: batch scores only discard the roots that are below the top best answers by more than their
+        rounding margins.
+    """
+    keys = list(indexes.keys())
+    stats = {'expanded': 0, 'pruned': 0}
+
+    # Sorted list of (key, -root, answer) of the top best answers so far
+    best = []
+    for start in range(0, len(order), chunk_size):
+        chunk = np.sort(order[start:start + chunk_size])
+        if progress is not None:
+            progress.update(len(chunk))
+
+        if len(best) == top:
+            averages = best[-1][0][0]
+            alive = chunk[bound[chunk] >= averages[1]]
+            stats['pruned'] += len(chunk) - len(alive)
+            if len(alive) < 1:
+                # Bounds decrease along order and the top-th answer only gets better
+                stats['pruned'] += len(order) - start - len(chunk)
+                if progress is not None:
+                    progress.update(len(order) - start - len(chunk))
+                break
+            chunk = alive
+
+        levels = [Candidates(chunk, chunk, np.ones(len(chunk)), np.zeros(len(chunk), dtype=np.int64))]
+        for k_index in range(1, len(keys)):
+            k_prev, k_current = keys[k_index - 1], keys[k_index]
+            prev = levels[-1]
+
+            targets = indexes[k_prev].balances[prev.positions] * ratios[k_current] / ratios[k_prev]
+            levels.append(expand_candidates(indexes[k_current], prev, targets, eps=eps, k=k))
+            stats['expanded'] += len(levels[-1])
+
+            if len(best) == top and k_index < len(keys) - 1:
+                chunk = prune_chunk(levels, chunk, best[-1][0][0])
+                stats['pruned'] += len(levels[0]) - len(chunk)
+                levels = [level.select(chunk) for level in levels]
+
+        # Batch keys with their margins, the top-th lower bound is below the exact key of the top best answers
+        averages, variances, margins = score_roots(levels, chunk)
+        batch = np.column_stack([averages, -variances])
+        margins = np.column_stack([margins, margins])
+        lower = np.vstack([np.array([a + v for (a, v), _, _ in best], dtype=np.float64).reshape(-1, batch.shape[1]),
+                           batch - margins])
+        if len(lower) >= top:
+            threshold = lower[np.lexsort(lower.T[::-1])[len(lower) - top]]
+            chunk = chunk[~lex_below(batch + margins, threshold)]
+
+        # Keep the top best of the chunk and of the previous chunks by exact key, the first root wins ties
+        items = [(key, -root, None) for root, key in zip(chunk.tolist(), exact_keys(levels, chunk))]
+        best = heapq.nlargest(top, best + items, key=lambda item: item[:2])
+
+        for i, (key, neg_root, answer) in enumerate(best):
+            if answer is None:
+                bounds = [level.bounds(np.array([-neg_root])) for level in levels]
+                answer = {c: level.accounts(indexes[c], slice(b[0][0], b[1][0]))
+                          for c, level, b in zip(keys, levels, bounds)}
+                best[i] = (key, neg_root, FinderAnswer(answer, key=key))
+
+    return best, stats
+
+
+# Arguments of scan_roots() of the running Finder.find_top(), inherited by its forked workers
+shared_scan = None
+
+
+def scan_partition(order):
+    """
+    Worker function of Finder.find_top(): scans a share of the roots with shared_scan
+    """
+    indexes, ratios, bound, top, eps, k, chunk_size = shared_scan
+    return scan_roots(indexes, ratios, order, bound, top, eps, k, chunk_size)
+
+
+def paper_distance(alpha, balances, low, high):
+    """
+    Lower bound of sum(|alpha - share|) over all the completions of partial choices.
+
+    Parameters
+    ----------
+    alpha: numpy.ndarray
+        Target share of each coin
+
+    balances: numpy.ndarray
+        Balances of the coins already chosen, one row per partial choice
+
+    low, high: numpy.ndarray
+        Smallest and largest candidate balance of the coins left, one row per partial choice
+
+    Returns
+    -------
+    distance: numpy.ndarray
+        One lower bound per partial choice
+    """
+    chosen = balances.sum(axis=1)
+    total_low, total_high = chosen + low.sum(axis=1), chosen + high.sum(axis=1)
+
+    # The share of a coin lies between its smallest balance over the largest total and the opposite
+    share_low = np.column_stack([balances, low]) / total_high[:, None]
+    share_high = np.column_stack([balances, high]) / total_low[:, None]
+    return np.maximum(0.0, np.maximum(share_low - alpha, alpha - share_high)).sum(axis=1)
+
+
+def beam_rank(owner, bound):
+    """
+    Rank of each partial choice among the ones of the same root, by decreasing bound, ties in order
+    """
+    order = np.lexsort((-bound, owner))
+    first = np.searchsorted(owner[order], owner[order], side='left')
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order)) - first
+    return rank
 
 
 def check_finder_condition(ratios):
@@ -114,45 +344,595 @@ def check_finder_condition(ratios):
     if len(ratios.keys()) < 2:
         raise ValueError(f"Steak balances should have at least two steaks but given {len(ratios.keys())}")
 
+
+def aggregate_balances(db, turn_number, coins, since=0, chunk_size=10000):
+    """
+    Computes the balance of every account with a single GROUP BY over the transactions joined to the accounts.
+    Rows are streamed from the database in chunks.
+
+    Parameters
+    ----------
+    db: BlockSim.orm.database.Database()
+        Database object
+
+    turn_number: int
+        Transactions with time < turn_number are taken into account
+
+    coins: list
+        Crypto names to load
+
+    since: int
+        Transactions with time < since are left out, which gives the change of the balances since that turn
+
+    chunk_size: int
+        Number of rows fetched at once
+
+    Returns
+    -------
+    balances: dict
+        Maps each coin to a dictionary of account id to balance, rounded to 8 decimals like in the simulator
+    """
+    trx = Transaction.__table__
+    in_range = sa.and_(trx.c.time >= since, trx.c.time < turn_number)
+    credits = sa.select(trx.c.dst.label('account'), trx.c.amount.label('amount')).where(in_range)
+    debits = sa.select(trx.c.src.label('account'), (-trx.c.amount).label('amount')) \
+        .where(in_range, trx.c.src.isnot(None))
+    flows = sa.union_all(credits, debits).subquery()
+
+    acc = Account.__table__
+    query = sa.select(acc.c.id, acc.c.crypto_type, sa.func.sum(flows.c.amount)) \
+        .join(flows, flows.c.account == acc.c.id) \
+        .where(acc.c.crypto_type.in_(coins)) \
+        .group_by(acc.c.id, acc.c.crypto_type)
+
+    balances = {k: dict() for k in coins}
+    with db.engine.connect() as connection:
+        result = connection.execution_options(stream_results=True, yield_per=chunk_size).execute(query)
+        for acc_id, crypto_type, balance in result:
+            balances[crypto_type][acc_id] = round(balance, 8)
+
+    return balances
+
+
+def stream_balances(db, turn_number, coins, since=0, chunk_size=100000):
+    """
+    Same as aggregate_balances(), but reads the transactions in chunks and sums them into a NumPy array indexed by
+    account id. Memory stays proportional to the number of accounts, whatever the size of the transactions table.
+    """
+    trx, acc = Transaction.__table__, Account.__table__
+
+    with db.engine.connect() as connection:
+        connection = connection.execution_options(stream_results=True, yield_per=chunk_size)
+        size = (connection.execute(sa.select(sa.func.max(acc.c.id))).scalar() or 0) + 1
+        totals = np.zeros(size, dtype=np.float64)
+
+        # Miner gifts have no source, they are read with src = -1
+        query = sa.select(sa.func.coalesce(trx.c.src, -1), trx.c.dst, trx.c.amount) \
+            .where(trx.c.time >= since, trx.c.time < turn_number)
+        for chunk in connection.execute(query).partitions():
+            src, dst, amount = (np.array(column) for column in zip(*chunk))
+            has_src = src >= 0
+            totals += np.bincount(dst, weights=amount, minlength=size)
+            totals -= np.bincount(src[has_src], weights=amount[has_src], minlength=size)
+
+        # The simulator rounds balances to 8 decimals, rounding drops the noise of the summation
+        totals = np.round(totals, 8)
+
+        balances = {k: dict() for k in coins}
+        query = sa.select(acc.c.id, acc.c.crypto_type).where(acc.c.crypto_type.in_(coins))
+        for chunk in connection.execute(query).partitions():
+            for acc_id, crypto_type in chunk:
+                if totals[acc_id] != 0:
+                    balances[crypto_type][acc_id] = float(totals[acc_id])
+
+    return balances
+
+
+balance_loaders = {
+    'aggregate': aggregate_balances,
+    'stream': stream_balances,
+}
+
+
+def checkpoint_balances(db, turn_number, coins, loader='aggregate'):
+    """
+    Reads the balances from the latest checkpoint written by the simulator at or before turn_number, and replays
+    the transactions from that checkpoint on with one of balance_loaders.
+
+    Parameters
+    ----------
+    db: BlockSim.orm.database.Database()
+        Database object
+
+    turn_number: int
+        Transactions with time < turn_number are taken into account
+
+    coins: list
+        Crypto names to load
+
+    loader: str
+        Key of balance_loaders used to replay the transactions after the checkpoint
+
+    Returns
+    -------
+    balances: dict
+        Same as aggregate_balances(), or None if there is no usable checkpoint
+    """
+    turns = [turn for turn in db.checkpoint_turns() if turn <= turn_number]
+    if not turns:
+        return None
+
+    start = turns[-1]
+    acc, cp = Account.__table__, BalanceCheckpoint.__table__
+    query = sa.select(cp.c.account_id, acc.c.crypto_type, cp.c.balance) \
+        .join(acc, acc.c.id == cp.c.account_id) \
+        .where(cp.c.turn == start, acc.c.crypto_type.in_(coins))
+
+    balances = {k: dict() for k in coins}
+    with db.engine.connect() as connection:
+        for acc_id, crypto_type, balance in connection.execution_options(stream_results=True).execute(query):
+            balances[crypto_type][acc_id] = balance
+
+    if start < turn_number:
+        delta = balance_loaders[loader](db, turn_number, coins, since=start)
+        for crypto_type, changes in delta.items():
+            coin_balances = balances[crypto_type]
+            for acc_id, change in changes.items():
+                coin_balances[acc_id] = round(coin_balances.get(acc_id, 0.0) + change, 8)
+
+    return balances
+
+
+def account_owners(db, coins, after=0, chunk_size=100000):
+    """
+    Reads the owner of every account of the given coins with one join over accounts and users.
+
+    Parameters
+    ----------
+    db: BlockSim.orm.database.Database()
+        Database object
+
+    coins: list
+        Crypto names
+
+    after: int
+        Only accounts with a larger id are read
+
+    chunk_size: int
+        Number of rows fetched at once
+
+    Returns
+    -------
+    (ids, owners): tuple
+        Account ids in increasing order and the id of their owner. Accounts without an owner are left out.
+    """
+    acc, usr = Account.__table__, User.__table__
+    query = sa.select(acc.c.id, usr.c.id).join(usr, usr.c.id == acc.c.owner_id) \
+        .where(acc.c.crypto_type.in_(coins), acc.c.id > after)
+
+    ids, owners = [], []
+    with db.engine.connect() as connection:
+        result = connection.execution_options(stream_results=True, yield_per=chunk_size).execute(query)
+        for chunk in result.partitions():
+            chunk_ids, chunk_owners = zip(*chunk)
+            ids.append(np.array(chunk_ids, dtype=np.int64))
+            owners.append(np.array(chunk_owners, dtype=np.int64))
+
+    ids = np.concatenate(ids) if ids else np.zeros(0, dtype=np.int64)
+    owners = np.concatenate(owners) if owners else np.zeros(0, dtype=np.int64)
+    order = np.argsort(ids)
+    return ids[order], owners[order]
+
+
+def merge_owners(known, new):
+    """
+    Adds the (ids, owners) pairs of new to the ones of known, both as returned by account_owners(). Accounts that
+    are already known are skipped.
+    """
+    ids, owners = known
+    new_ids, index = np.unique(new[0], return_index=True)
+    position = np.searchsorted(ids, new_ids)
+    found = position < len(ids)
+    found[found] = ids[position[found]] == new_ids[found]
+
+    return (np.insert(ids, position[~found], new_ids[~found]),
+            np.insert(owners, position[~found], new[1][index[~found]]))
+
+
+def group_by_owner(db, balances, chunk_size=100000, owners=None):
+    """
+    Groups funded accounts by owner.
+
+    Parameters
+    ----------
+    db: BlockSim.orm.database.Database()
+        Database object
+
+    balances: dict
+        Maps each coin to a dictionary of account id to balance
+
+    chunk_size: int
+        Number of rows fetched at once
+
+    owners: tuple
+        Output of account_owners() for the coins of balances, read from the database by default
+
+    Returns
+    -------
+    users: BlockSim.finder.classes.SyntheticUsers()
+        Funded accounts grouped by owner
+    """
+    coins = list(balances.keys())
+    account_ids = np.fromiter(itertools.chain(*(b.keys() for b in balances.values())), dtype=np.int64)
+    funds = np.fromiter(itertools.chain(*(b.values() for b in balances.values())), dtype=np.float64)
+    coin_codes = np.repeat(np.arange(len(coins)), [len(b) for b in balances.values()])
+
+    ids, owners = account_owners(db, coins, chunk_size=chunk_size) if owners is None else owners
+
+    # Funded accounts without an owner are left out, like accounts of a deleted user
+    position = np.searchsorted(ids, account_ids)
+    found = position < len(ids)
+    found[found] = ids[position[found]] == account_ids[found]
+
+    return SyntheticUsers(owners[position[found]], coin_codes[found], funds[found], account_ids[found], coins)
+
+
+# Finder of the running Finder.find_many(), inherited by its forked workers
+shared_finder = None
+
+
+def find_batch(batch):
+    """
+    Worker function of Finder.find_many(): runs a batch of queries on shared_finder
+
+    Returns
+    -------
+    results: dict
+        Maps the position of each query to its result
+    """
+    method, kwargs, queries = batch
+    return {i: getattr(shared_finder, method)(ratios, **kwargs) for i, ratios in queries}
+
+
+def index_file(db, turn_number):
+    """
+    Default file of the sorted indexes of a Finder, next to the database file
+    """
+    database = db.engine.url.database
+    if not database or database == ':memory:':
+        raise ValueError('Indexes of an in-memory database have no default file')
+
+    return f'{os.path.splitext(database)[0]}.finder-{turn_number}.npz'
+
+
 class Finder:
-    def __init__(self, turn_number, coins='all', synthetic=True):
-        db = Database()
-        available_coins = set(acc.crypto_type for acc in db.s.query(Account).all())
+    def __init__(self, turn_number, coins='all', synthetic=True, database=None, loader='aggregate',
+                 use_checkpoints=True, history=None, index_path=None, cache=None, log=None):
+        """
+        Loads the balances of all accounts after the transactions of turns 0 .. turn_number - 1.
+
+        Parameters
+        ----------
+        turn_number: int
+            Transactions with time < turn_number are taken into account
+
+        coins: list or str
+            Crypto names to load, or 'all'
+
+        synthetic: bool
+            Group the funded accounts by owner into self.users
+
+        database: BlockSim.orm.database.Database()
+            Database object, a new one on settings.database_url by default
+
+        loader: str
+            'aggregate' computes the balances with one GROUP BY query streamed from the database, 'stream' reads the
+            transactions in chunks and sums them in NumPy arrays, which keeps memory bounded by the number of accounts
+
+        use_checkpoints: bool
+            Start from the latest balance checkpoint of the simulator at or before turn_number, if any
+
+        history: BlockSim.finder.history.BalanceHistory()
+            Read the balances from this index instead of the transactions table
+
+        index_path: str
+            Load the sorted indexes saved by self.save_indexes() from this file if it exists, 'auto' for
+            index_file() next to the database
+
+        cache: BlockSim.finder.cache.ResultCache()
+            Optional cache of the results of self.find_top() and self.find_paper()
+
+        log: BlockSim.orm.columnar.ColumnarLog()
+            Read the balances and the owners of the accounts from this log instead of the database. The database
+            is then only used if given.
+        """
+        if loader not in balance_loaders:
+            raise ValueError(f"Unknown loader '{loader}', expected one of {list(balance_loaders.keys())}")
+
+        if log is not None:
+            db = database
+            available_coins = set(log.coins)
+        else:
+            db = Database() if database is None else database
+            available_coins = set(c for c, in db.s.query(Account.crypto_type).distinct())
 
         if isinstance(coins, str) and coins == 'all':
             coins = list(available_coins)
-        else:
+        elif available_coins:
+            # An empty database is accepted, e.g. to follow a simulation from its start with self.follow()
             if any(c not in available_coins for c in coins):
                 raise NameError(f"One/More of the coins in the list were not found in database!")
 
-        balances = {k: defaultdict(float) for k in coins}
         self.coins = coins
-
-        for t in tqdm(range(turn_number), desc="Reading transactions: "):
-            transactions = db.s.query(Transaction).filter_by(time=t).all()
-
-            for trx in transactions:
-                c_type = trx.destination.crypto_type
-                if c_type in self.coins:
-                    balances[c_type][trx.dst] += trx.amount
-
-                    if trx.src is not None:
-                        balances[c_type][trx.src] += trx.amount
+        self.turn_number = turn_number
+        self.db = db
+        self.loader = loader
+        self.log = log
+
+        balances = None
+        if log is not None:
+            balances = log.balances(turn_number, coins)
+        elif history is not None:
+            balances = {c: history.balances(c, turn_number) for c in coins}
+        elif use_checkpoints:
+            balances = checkpoint_balances(db, turn_number, coins, loader=loader)
+
+        if balances is None:
+            balances = balance_loaders[loader](db, turn_number, coins)
 
         self.balances = dict()
         for crypto_name, arr in balances.items():
             self.balances[crypto_name] = {k: v for k, v in arr.items() if v > 0}
 
+        # Owners of the accounts are kept to update self.users, see self.update()
+        self.users, self.account_owners = None, None
         if synthetic:
-            users = defaultdict(set)
+            self.account_owners = log.owners(coins) if log is not None else account_owners(db, coins)
+            self.users = group_by_owner(db, self.balances, owners=self.account_owners)
 
-            for acc_id, acc_balance in itertools.chain(*map(lambda x: x.items(), self.balances.values())):
-                acc_db = db.s.query(Account).get(acc_id)
-                users[acc_db.owner.id].add((acc_db.crypto_type, acc_balance, acc_id))
+        # Progress bars of the finder methods
+        self.progress = True
 
-            self.users = users
+        # Sorted indexes are built on first use, see self.index() and self.find_nn()
+        self.indexes = dict()
+        self.share_indexes = dict()
+        if index_path is not None:
+            self.load_indexes(index_path)
 
-    def find(self, ratios):
+        self.cache = cache
+        if cache is not None:
+            cache.bind(self.fingerprint())
+
+    def fingerprint(self):
+        """
+        Summary of the balances, which tells the results of a ResultCache apart
+        """
+        return self.turn_number, tuple(sorted((c, len(b), round(sum(b.values()), 8)) for c, b in self.balances.items()))
+
+    def index(self, coin):
+        """
+        Returns the accounts of a coin sorted by balance, as BlockSim.finder.classes.SortedBalances(). The index is
+        built on first use and cached until self.invalidate() is called.
+        """
+        if coin not in self.indexes:
+            self.indexes[coin] = SortedBalances.from_dict(self.balances[coin])
+        return self.indexes[coin]
+
+    def invalidate(self, coins=None, indexes=True):
+        """
+        Drops the cached indexes of the given coins, all coins by default, and the cached results. Call it after
+        changing self.balances. With indexes=False, the sorted indexes are kept, e.g. after self.update() which
+        updates them in place.
+        """
+        if indexes:
+            for coin in (list(self.indexes.keys()) if coins is None else coins):
+                self.indexes.pop(coin, None)
+
+        for key in list(self.share_indexes.keys()):
+            if coins is None or any(c in key[0] for c in coins):
+                self.share_indexes.pop(key)
+
+        if self.cache is not None:
+            self.cache.clear()
+            self.cache.bind(self.fingerprint())
+
+    def update(self, turn_number, balances, owners=None):
+        """
+        Moves the Finder to turn_number, given the new balance of every account that changed since self.turn_number.
+        self.balances, the sorted indexes built so far and self.users are updated in place. The indexes of
+        self.find_nn() on a changed coin are dropped and rebuilt on next use, and cached results are cleared.
+
+        Parameters
+        ----------
+        turn_number: int
+            Transactions with time < turn_number are taken into account
+
+        balances: dict
+            Maps coins to a dictionary of account id to new balance. Accounts whose balance is not positive are
+            dropped, coins that are not in self.coins are ignored.
+
+        owners: tuple
+            (account ids, owner ids) arrays of the accounts created since self.turn_number, needed to group them
+            into self.users
+        """
+        if owners is not None and self.account_owners is not None:
+            self.account_owners = merge_owners(self.account_owners, owners)
+
+        changed = [c for c in self.coins if balances.get(c)]
+        for coin in changed:
+            changes = balances[coin]
+            coin_balances = self.balances[coin]
+            for acc_id, balance in changes.items():
+                if balance > 0:
+                    coin_balances[acc_id] = balance
+                else:
+                    coin_balances.pop(acc_id, None)
+
+            ids = np.fromiter(changes.keys(), dtype=np.int64, count=len(changes))
+            funds = np.fromiter(changes.values(), dtype=np.float64, count=len(changes))
+            if coin in self.indexes:
+                self.indexes[coin].update(ids, funds)
+
+            if self.users is not None:
+                # Accounts without an owner are left out, like in group_by_owner()
+                known_ids, owner_ids = self.account_owners
+                position = np.searchsorted(known_ids, ids)
+                found = position < len(known_ids)
+                found[found] = known_ids[position[found]] == ids[found]
+                codes = np.full(found.sum(), self.users.coins.index(coin), dtype=np.int64)
+                self.users.update(owner_ids[position[found]], codes, funds[found], ids[found])
+
+        self.turn_number = turn_number
+        self.invalidate(changed, indexes=False)
+
+    def poll(self, turn_number=None):
+        """
+        Reads the transactions with self.turn_number <= time < turn_number from the database, or from self.log,
+        e.g. while it is being written by a simulation, and applies them with self.update().
+
+        Parameters
+        ----------
+        turn_number: int
+            Transactions with time < turn_number are taken into account, by default every transaction of the
+            database
+
+        Returns
+        -------
+        turn_number: int
+            The new self.turn_number
+        """
+        if self.log is not None:
+            self.log.reload()
+
+        if turn_number is None and self.log is not None:
+            turn_number = max(self.turn_number, self.log.n_turns)
+        elif turn_number is None:
+            with self.db.engine.connect() as connection:
+                last = connection.execute(sa.select(sa.func.max(Transaction.__table__.c.time))).scalar()
+            turn_number = self.turn_number if last is None else last + 1
+
+        if turn_number <= self.turn_number:
+            return self.turn_number
+
+        if self.log is not None:
+            delta = self.log.balances(turn_number, self.coins, since=self.turn_number)
+        else:
+            delta = balance_loaders[self.loader](self.db, turn_number, self.coins, since=self.turn_number)
+        balances = {c: {acc_id: round(self.balances[c].get(acc_id, 0.0) + change, 8)
+                        for acc_id, change in changes.items()} for c, changes in delta.items()}
+
+        owners = None
+        if self.account_owners is not None:
+            after = int(self.account_owners[0].max(initial=0))
+            owners = self.log.owners(self.coins, after=after) if self.log is not None else \
+                account_owners(self.db, self.coins, after=after)
+
+        self.update(turn_number, balances, owners)
+        return self.turn_number
+
+    def follow(self, turn_number, columns=None):
+        """
+        Applies a flush of a running simulation. Call it from the on_flush callback of
+        BlockSim.simulator.run.setup() to keep the Finder in line with the simulation.
+
+        Parameters
+        ----------
+        turn_number: int
+            Transactions with time < turn_number are taken into account
+
+        columns: list
+            Outputs of BlockSim.simulator.simulator.VectorCointSimulator.flush_columns() of the flush, which hold
+            the current balance of every new or changed account. When None, the flushed transactions are read
+            from the database with self.poll().
+
+        Returns
+        -------
+        turn_number: int
+            The new self.turn_number
+        """
+        if columns is None:
+            return self.poll(turn_number)
+
+        balances, ids, owners = defaultdict(dict), [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+        for coin_columns in columns:
+            if not coin_columns or coin_columns['crypto_type'] not in self.coins:
+                continue
+
+            a_ids, owner_ids, new_balances = coin_columns['accounts']
+            updated_balances, updated_ids = coin_columns['balances']
+            changes = balances[coin_columns['crypto_type']]
+            # Rounded like the balances written to the database, see columns_to_rows()
+            changes.update(zip(a_ids.tolist(), round_balances(new_balances)))
+            changes.update(zip(updated_ids.tolist(), round_balances(updated_balances)))
+            ids.append(a_ids)
+            owners.append(owner_ids)
+
+        self.update(turn_number, balances, (np.concatenate(ids), np.concatenate(owners)))
+        return self.turn_number
+
+    def save_indexes(self, path='auto'):
+        """
+        Builds the index of every coin and stores them in a single .npz file.
+
+        Parameters
+        ----------
+        path: str
+            File name, 'auto' for index_file() next to the database
+
+        Returns
+        -------
+        path: str
+            File name
+        """
+        if path == 'auto':
+            path = index_file(self.db, self.turn_number)
+
+        arrays = {'turn_number': np.array(self.turn_number), 'fingerprint': np.array(repr(self.fingerprint()))}
+        for coin in self.coins:
+            arrays[f'{coin}.ids'] = self.index(coin).ids
+            arrays[f'{coin}.balances'] = self.index(coin).balances
+
+        with open(path, 'wb') as f:
+            np.savez(f, **arrays)
+        return path
+
+    def load_indexes(self, path='auto'):
+        """
+        Loads the indexes stored by self.save_indexes(). Indexes of another turn, or whose balances do not match
+        self.balances according to self.fingerprint(), are ignored.
+
+        Parameters
+        ----------
+        path: str
+            File name, 'auto' for index_file() next to the database
+
+        Returns
+        -------
+        coins: list
+            Coins whose index was loaded
+        """
+        if path == 'auto':
+            path = index_file(self.db, self.turn_number)
+        if not os.path.exists(path):
+            return []
+
+        loaded = []
+        with np.load(path) as arrays:
+            if int(arrays['turn_number']) != self.turn_number:
+                return []
+            if 'fingerprint' not in arrays or str(arrays['fingerprint']) != repr(self.fingerprint()):
+                return []
+
+            for coin in self.coins:
+                if f'{coin}.ids' not in arrays or len(arrays[f'{coin}.ids']) != len(self.balances[coin]):
+                    continue
+
+                self.indexes[coin] = SortedBalances.from_sorted(arrays[f'{coin}.ids'], arrays[f'{coin}.balances'])
+                loaded.append(coin)
+
+        return loaded
+
+    def find(self, ratios, eps=None, k=None, chunk_size=10000, workers=None):
         """
         Run the finder algorithm to find the account with highest probability given steak
         percentages for each crypto coin type.
@@ -162,106 +942,319 @@ class Finder:
         ratios: dict
             ratios should be a dictionary mapping crypto names to steak percentage!
 
+        eps: float
+            Match the accounts within this relative tolerance of each target balance, instead of the equal or
+            nearest ones
+
+        k: int
+            Keep at most the k accounts nearest to each target balance
+
+        chunk_size: int
+            Number of root accounts expanded at once
+
+        workers: int
+            Number of worker processes, see self.find_top()
+
         Returns
         -------
         result: dict
             A dictionary mapping crypto_type to account id
 
         """
-        check_finder_condition(ratios)
-        # Sort coins from smallest number of accounts to largest
-        coin_order = sorted((len(self.balances[c]), c) for c in ratios.keys())
+        answers, _ = self.find_top(ratios, top=1, eps=eps, k=k, chunk_size=chunk_size, workers=workers)
+        return answers[0] if answers else None
 
-        # Sort accounts within each crypto-currency by balance
-        sorted_balances = OrderedDict()
-        for _, c in coin_order:
-            sorted_balances[c] = sorted(FinderAccount(balance, a_id) for a_id, balance in self.balances[c].items())
+    @cached_result('chunk_size', 'workers')
+    def find_top(self, ratios, top=10, eps=None, k=None, chunk_size=10000, workers=None):
+        """
+        Same as self.find(), but returns the top best answers, found by branch and bound.
 
-        # Metric = (accuracy, variance)
-        best_metric = (0, 1000)
-        keys = list(sorted_balances.keys())
-        answers = []
+        Answers are ranked by their list of average scores per coin, then by their variances. The average score of a
+        coin cannot exceed the largest confidence level of the previous coin, since confidence levels are multiplied
+        by values <= 1. Roots are expanded in decreasing order of this bound, and a root (or its partial chain) is
+        pruned as soon as its bound ranks below the current top-th answer. The scores are computed in batches, which
+        may round differently than FinderAnswer(), so they only prune with a margin and the remaining answers are
+        ranked by the exact key of FinderAnswer(). Equal answers are ranked by root, i.e. by balance then id on the
+        coin with the fewest accounts, like an exhaustive scan.
 
-        for acc in tqdm(sorted_balances[keys[0]], desc='Running reverse finder method'):
-            a_test = copy.deepcopy(acc)
-            a_test.cl = 1.0
-            answer = {keys[0]: [a_test]}
+        Parameters
+        ----------
+        ratios: dict
+            ratios should be a dictionary mapping crypto names to steak percentage!
 
-            for k_index in range(1, len(keys)):
-                k_prev, k_current = keys[k_index - 1], keys[k_index]
+        top: int
+            Number of answers
 
-                upcoming_answers = defaultdict(bool)
-                for acc_prev in answer[k_prev]:
-                    target_balance = acc_prev.balance * ratios[k_current] / ratios[k_prev]
-                    target_acc = FinderAccount(target_balance, -1)
-                    acc_list = copy.deepcopy(binary_find(target_acc, sorted_balances[k_current]))
+        eps, k, chunk_size:
+            See self.find()
 
-                    for acc_found in acc_list:
-                        acc_found.cl = acc_prev.cl * confidence_level(target_acc.balance, acc_found.balance)
+        workers: int
+            Number of worker processes scanning a share of the roots each, None scans them in this process
 
-                    acc_list = list(filter(lambda x: x.cl > 0.0, acc_list))
-                    for recent_account in acc_list:
-                        if upcoming_answers[recent_account.identifier]:
-                            upcoming_answers[recent_account.identifier].cl += recent_account.cl
-                        else:
-                            upcoming_answers[recent_account.identifier] = recent_account
-                        upcoming_answers[recent_account.identifier].voters += 1
+        Returns
+        -------
+        (answers, stats): tuple
+            Best answers first, as BlockSim.finder.classes.FinderAnswer(), and a dictionary with the number of
+            roots, of expanded candidates and of pruned roots
+        """
+        check_finder_condition(ratios)
+        # Sort coins from smallest number of accounts to largest
+        coin_order = sorted((len(self.balances[c]), c) for c in ratios.keys())
 
-                answer[k_current] = [v for v in upcoming_answers.values()]
+        # Accounts within each crypto-currency sorted by balance
+        indexes = OrderedDict((c, self.index(c)) for _, c in coin_order)
 
-            answers.append(FinderAnswer(answer))
+        keys = list(indexes.keys())
+        roots = indexes[keys[0]]
+        stats = {'roots': len(roots)}
 
-        answers = sorted(answers, reverse=True)
-        return answers[0]
+        # Every root has an average of 1.0 on the first coin, so roots are first ranked by the average of the second
+        # coin, bounded by the confidence level of the nearest account
+        bound = nearest_confidence(indexes[keys[1]], roots.balances * ratios[keys[1]] / ratios[keys[0]]) * SLACK
+        order = np.argsort(-bound, kind='stable')
 
-    def find_paper(self, ratios, st=-1):
+        if workers is None or workers < 2 or multiprocessing.current_process().daemon:
+            with tqdm(total=len(roots), desc='Running reverse finder method', disable=not self.progress) as progress:
+                best, scan = scan_roots(indexes, ratios, order, bound, top, eps, k, chunk_size, progress)
+        else:
+            # Roots are dealt round-robin, so every worker gets its share of the most promising ones first
+            global shared_scan
+            shared_scan = (indexes, ratios, bound, top, eps, k, chunk_size)
+            try:
+                with fork_context('Finder.find_top(workers=...)').Pool(workers) as pool:
+                    outputs = pool.map(scan_partition, [order[w::workers] for w in range(workers)])
+            finally:
+                shared_scan = None
+
+            # Each worker returns its local top, exact for its roots, so the merged top is exact
+            best = heapq.nlargest(top, [item for local, _ in outputs for item in local], key=lambda item: item[:2])
+            scan = {name: sum(local[name] for _, local in outputs) for name in ('expanded', 'pruned')}
+
+        stats.update(scan)
+        return [answer for _, _, answer in best], stats
+
+    @cached_result('chunk_size')
+    def find_paper(self, ratios, st=-1, eps=None, k=None, beam=None, chunk_size=10000):
         """
         Run the finder algorithm to find the account with highest probability given steak
         percentages for each crypto coin type.
         Source: Arxive paper
 
+        The accounts of each root are chosen coin by coin with a beam search. A partial choice is ranked by an upper
+        bound of its final score m - sum(|alpha - share|): the balances of the coins still to choose lie between the
+        smallest and largest candidate, which bounds the total balance and therefore every share.
+
         Parameters
         ----------
         ratios: dict
             ratios should be a dictionary mapping crypto names to steak percentage!
 
         st: float
-            Score threshold
+            Score threshold, only answers scoring above it are returned
+
+        eps: float
+            Match the accounts within this relative tolerance of each target balance, instead of the equal or
+            nearest ones
+
+        k: int
+            Keep at most the k accounts nearest to each target balance
+
+        beam: int
+            Number of partial choices kept per root at each coin. By default, all choices are kept, which gives the
+            same answer as scoring every combination of candidates.
+
+        chunk_size: int
+            Number of root accounts searched at once
 
         Returns
         -------
         result: dict
             A dictionary mapping crypto_type to account id
         """
-        if len(steak.keys()) < 2:
+        if len(ratios.keys()) < 2:
             return None
 
         check_finder_condition(ratios)
         coin_order = sorted((len(self.balances[c]), c) for c in ratios.keys())
 
-        # Sort accounts within each crypto-currency by balance
-        sorted_balances = OrderedDict()
-        for _, c in coin_order:
-            sorted_balances[c] = sorted(FinderAccount(balance, a_id) for a_id, balance in self.balances[c].items())
-
-        best_score = -1
+        # Accounts within each crypto-currency sorted by balance
+        indexes = OrderedDict((c, self.index(c)) for _, c in coin_order)
+
+        keys = list(indexes.keys())
+        roots = indexes[keys[0]]
+        alpha = np.array([ratios[c] for c in keys])
+        m = len(ratios.keys())
+
+        # Candidates of every root, looked up with one batch query per coin
+        starts, stops = [np.arange(len(roots))], [np.arange(1, len(roots) + 1)]
+        for i in range(1, len(keys)):
+            start, stop = indexes[keys[i]].lookup(roots.balances * ratios[keys[i]] / ratios[keys[0]], eps=eps, k=k)
+            starts.append(start)
+            stops.append(stop)
+
+        # Smallest and largest candidate balance of each coin, for each root
+        low = np.zeros((len(keys), len(roots)))
+        high = np.zeros((len(keys), len(roots)))
+        for i, c in enumerate(keys):
+            found = stops[i] > starts[i]
+            low[i, found] = indexes[c].balances[starts[i][found]]
+            high[i, found] = indexes[c].balances[stops[i][found] - 1]
+
+        best_score = st
         best_answer = None
-        keys = list(sorted_balances.keys())
-        for acc in tqdm(sorted_balances[keys[0]], desc='Running reverse finder method'):
-            answers = [[acc]]
+        for chunk_start in tqdm(range(0, len(roots), chunk_size), desc='Running reverse finder method',
+                                disable=not self.progress):
+            # Partial choices, in the order of itertools.product(): root, then position chosen in each coin
+            chosen = np.arange(chunk_start, min(chunk_start + chunk_size, len(roots)))[:, None]
+
+            for i in range(1, len(keys)):
+                owner = chosen[:, 0]
+                counts = stops[i][owner] - starts[i][owner]
+                rows = np.repeat(np.arange(len(chosen)), counts)
+                positions = np.arange(counts.sum()) + np.repeat(starts[i][owner] - (np.cumsum(counts) - counts), counts)
+                chosen = np.column_stack([chosen[rows], positions])
+
+                owner = chosen[:, 0]
+                balances = np.column_stack([indexes[c].balances[chosen[:, j]] for j, c in enumerate(keys[:i + 1])])
+                bound = m - paper_distance(alpha, balances, low[i + 1:, owner].T, high[i + 1:, owner].T)
+
+                # Scores are compared up to rounding, a later choice only wins if it scores strictly higher
+                keep = bound + 1e-9 > best_score
+                if beam is not None:
+                    keep &= beam_rank(owner, bound) < beam
+                chosen = chosen[keep]
+
+            if len(chosen) < 1:
+                continue
+
+            # Exact scores, same operations as FinderAnswerPaper.get_score()
+            balances = [indexes[c].balances[chosen[:, j]] for j, c in enumerate(keys)]
+            bsum = 0
+            for b in balances:
+                bsum = bsum + b
+            distance = 0
+            for c, b in zip(keys, balances):
+                distance = distance + np.abs(ratios[c] - b / bsum)
+            scores = m - distance
+
+            best = int(np.argmax(scores))
+            if scores[best] > best_score:
+                best_score = float(scores[best])
+                best_answer = FinderAnswerPaper({c: FinderAccount(float(b[best]), int(indexes[c].ids[chosen[best, j]]))
+                                                 for j, (c, b) in enumerate(zip(keys, balances))}, ratios)
 
-            for i in range(2, len(keys)):
-                target_balance = acc.balance * ratios[keys[i]] / ratios[keys[0]]
-                target_acc = FinderAccount(target_balance, -1)
-                acc_list = binary_find(target_acc, sorted_balances[keys[i]])
-                answers.append(acc_list)
+        return best_answer
 
-            for ans in itertools.product(*answers):
-                new_ans = FinderAnswerPaper({k: a for k,a in zip(keys, ans)}, ratios)
-                if new_ans.get_score() > best_score:
-                    best_answer = new_ans
+    def find_nn(self, ratios, k=1, cell=None):
+        """
+        Finds the accounts of a single owner whose balances best match the ratios, with a nearest neighbour search
+        over the log-balance ratios of each owner's holdings, see BlockSim.finder.neighbours.ShareIndex(). The
+        index of each coin set is built on first use. Needs the synthetic users of the Finder.
 
-        return best_answer
+        Parameters
+        ----------
+        ratios: dict
+            ratios should be a dictionary mapping crypto names to steak percentage!
+
+        k: int
+            Number of answers
+
+        cell: float
+            Width of the grid cells of the index in log space, see BlockSim.finder.neighbours.ShareIndex()
+
+        Returns
+        -------
+        answers: list
+            (distance, BlockSim.finder.classes.FinderAnswerPaper()) of the k nearest holdings, closest first
+        """
+        check_finder_condition(ratios)
+        if self.users is None:
+            raise ValueError('find_nn needs a Finder built with synthetic=True')
+
+        key = (tuple(sorted(ratios.keys())), cell)
+        if key not in self.share_indexes:
+            self.share_indexes[key] = ShareIndex(self.users, key[0], cell=cell)
+        index = self.share_indexes[key]
+
+        rows, distances = index.query(ratios, k=k)
+        return [(distance, FinderAnswerPaper({c: FinderAccount(b, a_id) for c, b, a_id in
+                                              zip(index.coins, index.balances[row].tolist(),
+                                                  index.account_ids[row].tolist())}, ratios))
+                for row, distance in zip(rows.tolist(), distances.tolist())]
+
+    def find_many(self, list_of_ratios, method='find', workers=None, batch_size=16, **kwargs):
+        """
+        Runs a finder method for many queries, e.g. one per user of self.users.
+
+        Queries are grouped by coin set, and each batch of queries sharing the same coins is run by one worker
+        process. Workers are forked after the indexes of all the queried coins are built, so they share them
+        with this process instead of receiving a pickled copy.
+
+        Parameters
+        ----------
+        list_of_ratios: list
+            Ratios of each query, see self.find()
+
+        method: str
+            'find', 'find_top' or 'find_paper'
+
+        workers: int
+            Number of worker processes, None runs the queries in this process
+
+        batch_size: int
+            Maximum number of queries sent to a worker at once
+
+        kwargs:
+            Keyword arguments of the method, e.g. eps or k
+
+        Yields
+        ------
+        result: object
+            Result of the method for each query, in input order
+        """
+        if method not in ('find', 'find_top', 'find_paper'):
+            raise ValueError(f"Unknown method '{method}', expected 'find', 'find_top' or 'find_paper'")
+
+        list_of_ratios = list(list_of_ratios)
+        for coin in set(c for ratios in list_of_ratios for c in ratios.keys()):
+            self.index(coin)
+
+        # Batches of queries on the same coins, in input order within each coin set
+        groups = defaultdict(list)
+        for i, ratios in enumerate(list_of_ratios):
+            groups[tuple(sorted(ratios.keys()))].append(i)
+        batches = [(method, kwargs, [(i, list_of_ratios[i]) for i in group[start:start + batch_size]])
+                   for group in groups.values() for start in range(0, len(group), batch_size)]
+
+        progress, self.progress = self.progress, False
+        global shared_finder
+        shared_finder = self
+        pool = None
+        try:
+            if workers is None or workers < 2:
+                outputs = map(find_batch, batches)
+            else:
+                pool = fork_context('Finder.find_many(workers=...)').Pool(workers)
+                outputs = pool.imap_unordered(find_batch, batches)
+
+            # Results of later queries wait until all the earlier ones are out
+            done, position = dict(), 0
+            with tqdm(total=len(list_of_ratios), desc='Running finder queries', disable=not progress) as bar:
+                for output in outputs:
+                    done.update(output)
+                    bar.update(len(output))
+                    while position in done:
+                        yield done.pop(position)
+                        position += 1
+
+            if pool is not None:
+                pool.close()
+                pool.join()
+        finally:
+            if pool is not None:
+                pool.terminate()
+            shared_finder = None
+            self.progress = progress
 
 
 if __name__ == '__main__':
@@ -0,0 +1,225 @@
+from BlockSim.orm.database import Account, Transaction
+import sqlalchemy as sa
+import numpy as np
+import json
+import os
+
+
+class CoinHistory:
+    def __init__(self, ids, offsets, columns, amounts, snapshots, interval):
+        """
+        Balance history of one coin: dense snapshots every interval turns plus the per-turn balance changes.
+
+        Parameters
+        ----------
+        ids: numpy.ndarray
+            Sorted account ids, the columns of the balance vectors
+
+        offsets: numpy.ndarray
+            The changes of turn t are columns[offsets[t]:offsets[t + 1]] and amounts[offsets[t]:offsets[t + 1]]
+
+        columns: numpy.ndarray
+            Column of the account of each change
+
+        amounts: numpy.ndarray
+            Signed amount of each change
+
+        snapshots: numpy.ndarray
+            snapshots[k] holds the balances after every transaction with time < k * interval
+
+        interval: int
+            Number of turns between two snapshots
+        """
+        self.ids = ids
+        self.offsets = offsets
+        self.columns = columns
+        self.amounts = amounts
+        self.snapshots = snapshots
+        self.interval = interval
+
+    @property
+    def n_turns(self):
+        return len(self.offsets) - 1
+
+    def changes(self, t1, t2):
+        """
+        Returns the (columns, amounts) of the changes of turns t1 .. t2 - 1
+        """
+        t1, t2 = (min(max(t, 0), self.n_turns) for t in (t1, t2))
+        rows = slice(self.offsets[t1], self.offsets[max(t1, t2)])
+        return self.columns[rows], self.amounts[rows]
+
+    def balances(self, turn):
+        """
+        Balances after every transaction with time < turn, starting from the closest snapshot, before or after.
+
+        Returns
+        -------
+        (ids, balances): tuple
+            Account ids and their balance
+        """
+        turn = min(max(turn, 0), self.n_turns)
+        k = min(int(round(turn / self.interval)), len(self.snapshots) - 1)
+        start = k * self.interval
+
+        balances = np.array(self.snapshots[k], dtype=np.float64)
+        if start <= turn:
+            columns, amounts = self.changes(start, turn)
+            balances += np.bincount(columns, weights=amounts, minlength=len(self.ids))
+        else:
+            columns, amounts = self.changes(turn, start)
+            balances -= np.bincount(columns, weights=amounts, minlength=len(self.ids))
+
+        return self.ids, np.round(balances, 8)
+
+    def net_flow(self, t1, t2):
+        """
+        Net change of the balances over the transactions with t1 <= time < t2, restricted to the accounts that moved.
+
+        Returns
+        -------
+        (ids, flows): tuple
+            Account ids and their net flow
+        """
+        columns, amounts = self.changes(t1, t2)
+        moved, inverse = np.unique(columns, return_inverse=True)
+        return self.ids[moved], np.round(np.bincount(inverse, weights=amounts, minlength=len(moved)), 8)
+
+
+class BalanceHistory:
+    def __init__(self, coins):
+        """
+        Balance-history index answering "balances of coin C at turn t" and "net flow between turns t1 and t2" from
+        periodic dense snapshots plus per-turn change blocks, in time proportional to the replayed changes.
+        Build it with BalanceHistory.build() or BalanceHistory.load().
+
+        Parameters
+        ----------
+        coins: dict
+            Maps crypto names to BlockSim.finder.history.CoinHistory()
+        """
+        self.coins = coins
+
+    @classmethod
+    def build(cls, db, interval=50, chunk_size=100000):
+        """
+        Reads the whole transactions table once and builds the index.
+
+        Parameters
+        ----------
+        db: BlockSim.orm.database.Database()
+            Database object
+
+        interval: int
+            Number of turns between two dense snapshots
+
+        chunk_size: int
+            Number of rows fetched at once
+
+        Returns
+        -------
+        history: BlockSim.finder.history.BalanceHistory()
+        """
+        acc, trx = Account.__table__, Transaction.__table__
+
+        with db.engine.connect() as connection:
+            connection = connection.execution_options(stream_results=True, yield_per=chunk_size)
+            accounts = connection.execute(sa.select(acc.c.id, acc.c.crypto_type)).all()
+
+            query = sa.select(trx.c.time, sa.func.coalesce(trx.c.src, -1), trx.c.dst, trx.c.amount)
+            chunks = [[np.array(column) for column in zip(*chunk)] for chunk in connection.execute(query).partitions()]
+
+        time, src, dst = (np.concatenate([np.zeros(0, dtype=np.int64)] + [c[i] for c in chunks]) for i in range(3))
+        amount = np.concatenate([np.zeros(0)] + [c[3] for c in chunks])
+
+        names = sorted(set(crypto_type for _, crypto_type in accounts))
+        codes = {name: code for code, name in enumerate(names)}
+        a_ids = np.array([a_id for a_id, _ in accounts], dtype=np.int64)
+        a_codes = np.array([codes[crypto_type] for _, crypto_type in accounts], dtype=np.int64)
+
+        coin_of = np.full(a_ids.max(initial=0) + 1, -1, dtype=np.int64)
+        coin_of[a_ids] = a_codes
+
+        # Every transaction credits its destination and, unless it is a miner gift, debits its source
+        has_src = src >= 0
+        e_time = np.concatenate([time, time[has_src]])
+        e_account = np.concatenate([dst, src[has_src]])
+        e_amount = np.concatenate([amount, -amount[has_src]])
+        e_coin = coin_of[e_account]
+
+        n_turns = int(time.max(initial=-1)) + 1
+        coins = dict()
+        for code, name in enumerate(names):
+            ids = np.sort(a_ids[a_codes == code])
+
+            sel = np.flatnonzero(e_coin == code)
+            order = sel[np.argsort(e_time[sel], kind='stable')]
+            columns = np.searchsorted(ids, e_account[order])
+            amounts = e_amount[order]
+            offsets = np.searchsorted(e_time[order], np.arange(n_turns + 1))
+
+            n_snapshots = n_turns // interval + 1
+            snapshots = np.zeros((n_snapshots, len(ids)), dtype=np.float64)
+            for k in range(1, n_snapshots):
+                rows = slice(offsets[(k - 1) * interval], offsets[k * interval])
+                snapshots[k] = snapshots[k - 1] + np.bincount(columns[rows], weights=amounts[rows],
+                                                              minlength=len(ids))
+
+            coins[name] = CoinHistory(ids, offsets, columns, amounts, snapshots, interval)
+
+        return cls(coins)
+
+    def save(self, path):
+        """
+        Stores the index as NumPy arrays in the directory path
+        """
+        os.makedirs(path, exist_ok=True)
+        meta = {'coins': list(self.coins.keys()), 'interval': {c: h.interval for c, h in self.coins.items()}}
+
+        for i, (name, history) in enumerate(self.coins.items()):
+            for attr in ('ids', 'offsets', 'columns', 'amounts', 'snapshots'):
+                np.save(os.path.join(path, f'{i}.{attr}.npy'), getattr(history, attr))
+
+        with open(os.path.join(path, 'history.json'), 'w') as f:
+            json.dump(meta, f)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads an index stored by self.save(). Arrays are memory-mapped, so only the replayed parts are read.
+        """
+        with open(os.path.join(path, 'history.json')) as f:
+            meta = json.load(f)
+
+        coins = dict()
+        for i, name in enumerate(meta['coins']):
+            arrays = {attr: np.load(os.path.join(path, f'{i}.{attr}.npy'), mmap_mode='r')
+                      for attr in ('ids', 'offsets', 'columns', 'amounts', 'snapshots')}
+            coins[name] = CoinHistory(interval=meta['interval'][name], **arrays)
+
+        return cls(coins)
+
+    def balances(self, coin, turn):
+        """
+        Balances of a coin after every transaction with time < turn
+
+        Returns
+        -------
+        balances: dict
+            Maps account ids to their balance, funded accounts only
+        """
+        ids, balances = self.coins[coin].balances(turn)
+        funded = balances > 0
+        return dict(zip(ids[funded].tolist(), balances[funded].tolist()))
+
+    def net_flow(self, coin, t1, t2):
+        """
+        Net flow of every account of a coin over the transactions with t1 <= time < t2
+
+        Returns
+        -------
+        flows: dict
+            Maps account ids to their net flow, accounts that did not move are left out
+        """
+        ids, flows = self.coins[coin].net_flow(t1, t2)
+        return dict(zip(ids.tolist(), flows.tolist()))
@@ -0,0 +1,121 @@
+import numpy as np
+
+
+# Average number of points per grid cell when the cell width is chosen by ShareIndex
+POINTS_PER_CELL = 4
+
+
+class ShareIndex:
+    def __init__(self, users, coins, cell=None):
+        """
+        Grid-bucket index over the holdings of each owner in a set of coins. Every combination of one account per
+        coin of the same owner is a point of log-balance ratios to the first coin, so the query "which accounts
+        hold these ratios" becomes a nearest neighbour search that does not depend on the coins left out.
+
+        Parameters
+        ----------
+        users: BlockSim.finder.classes.SyntheticUsers()
+            Funded accounts grouped by owner
+
+        coins: list
+            Crypto names, the first one is the reference of the ratios
+
+        cell: float
+            Width of the grid cells in log space, by default about POINTS_PER_CELL points per cell
+        """
+        self.coins = list(coins)
+
+        # Accounts of each coin, sorted by owner
+        codes = {name: code for code, name in enumerate(users.coins)}
+        columns = []
+        for coin in self.coins:
+            rows = np.flatnonzero(users.coin_codes == codes[coin]) if coin in codes else np.zeros(0, dtype=np.int64)
+            columns.append(rows)
+
+        # Join the coins on the owner, one tuple per combination of accounts
+        owners = users.owner_ids[columns[0]]
+        tuples = [columns[0]]
+        for rows in columns[1:]:
+            left = np.searchsorted(users.owner_ids[rows], owners, side='left')
+            right = np.searchsorted(users.owner_ids[rows], owners, side='right')
+            counts = right - left
+
+            source = np.repeat(np.arange(len(owners)), counts)
+            chosen = np.arange(counts.sum()) + np.repeat(left - (np.cumsum(counts) - counts), counts)
+            owners = owners[source]
+            tuples = [t[source] for t in tuples] + [rows[chosen]]
+
+        self.owners = owners
+        self.account_ids = np.column_stack([users.account_ids[t] for t in tuples])
+        self.balances = np.column_stack([users.balances[t] for t in tuples])
+        self.points = np.log(self.balances[:, 1:]) - np.log(self.balances[:, :1])
+
+        # About a few points per cell by default
+        d = self.points.shape[1]
+        if cell is None:
+            spread = float(np.max(np.ptp(self.points, axis=0), initial=0.0)) if len(self.points) > 0 else 0.0
+            cell = spread / max(1.0, (len(self.points) / POINTS_PER_CELL) ** (1 / d)) if spread > 0 else 1.0
+        self.cell = cell
+
+        # Group the points by grid cell
+        coords = np.floor(self.points / cell).astype(np.int64)
+        self.cells, inverse = np.unique(coords.reshape(-1, d), axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+        self.order = np.argsort(inverse, kind='stable')
+        self.offsets = np.append(0, np.cumsum(np.bincount(inverse, minlength=len(self.cells))))
+
+    def __len__(self):
+        return len(self.owners)
+
+    def __repr__(self):
+        return f"ShareIndex ({len(self)} points, {len(self.cells)} cells, coins={self.coins})"
+
+    def __str__(self):
+        return self.__repr__()
+
+    def query(self, ratios, k=1):
+        """
+        Finds the k points nearest to the log-ratios of the query, visiting the grid cells ring by ring around it.
+        Once the k-th distance is within the rings visited, no point further out can be closer.
+
+        Parameters
+        ----------
+        ratios: dict
+            Maps each crypto name of self.coins to its steak percentage
+
+        k: int
+            Number of points
+
+        Returns
+        -------
+        (rows, distances): tuple
+            Rows of the nearest points, closest first, and their Euclidean distance in log space
+        """
+        shares = np.array([ratios[c] for c in self.coins], dtype=np.float64)
+        if np.any(shares <= 0):
+            raise ValueError('Nearest neighbour queries need positive ratios')
+
+        target = np.log(shares[1:]) - np.log(shares[0])
+        center = np.floor(target / self.cell).astype(np.int64)
+
+        # Chebyshev distance of every occupied cell to the cell of the query, in cells
+        rings = np.abs(self.cells - center).max(axis=1) if len(self.cells) > 0 else np.zeros(0, dtype=np.int64)
+        by_ring = np.argsort(rings, kind='stable')
+        radii, starts = np.unique(rings[by_ring], return_index=True)
+        starts = np.append(starts, len(by_ring))
+
+        rows, distances = np.zeros(0, dtype=np.int64), np.zeros(0)
+        for radius, start, stop in zip(radii.tolist(), starts[:-1].tolist(), starts[1:].tolist()):
+            cells = by_ring[start:stop]
+            new_rows = np.concatenate([self.order[self.offsets[c]:self.offsets[c + 1]] for c in cells.tolist()])
+
+            rows = np.concatenate([rows, new_rows])
+            distances = np.concatenate([distances, np.linalg.norm(self.points[new_rows] - target, axis=1)])
+            best = np.lexsort((rows, distances))[:k]
+            rows, distances = rows[best], distances[best]
+
+            # Points in cells further out are more than radius cells away on some axis
+            if len(rows) >= k and distances[-1] <= radius * self.cell:
+                break
+
+        return rows, distances
@@ -0,0 +1,75 @@
+from BlockSim.orm.database import Account, Database, Transaction, User
+import tempfile
+import random
+import time
+import os
+
+
+def make_rows(n_users, n_accounts, n_transactions, seed=0):
+    """
+    Builds random users, accounts and transactions as plain tuples for Database.add_rows()
+    """
+    rnd = random.Random(seed)
+    users = [(u_id,) for u_id in range(1, n_users + 1)]
+    accounts = [(a_id, rnd.randint(1, n_users), 'Bitcoin', 0.0) for a_id in range(1, n_accounts + 1)]
+    transactions = [(t_id, rnd.random(), t_id // 1000, rnd.randint(1, n_accounts), rnd.randint(1, n_accounts))
+                    for t_id in range(1, n_transactions + 1)]
+    return dict(users=users, accounts=accounts, transactions=transactions)
+
+
+def make_objects(rows):
+    """
+    Builds the ORM objects matching make_rows(), linked through relationships the same way the simulator does
+    """
+    users = [User() for _ in rows['users']]
+    accounts = [Account(owner=users[owner_id - 1], crypto_type=crypto_type, balance=balance)
+                for _, owner_id, crypto_type, balance in rows['accounts']]
+    transactions = [Transaction(amount=amount, time=t, source=accounts[src - 1], destination=accounts[dst - 1])
+                    for _, amount, t, src, dst in rows['transactions']]
+    return users + accounts + transactions
+
+
+def benchmark_write(n_users=10000, n_accounts=20000, n_transactions=200000):
+    """
+    Writes the same rows through Database.add_objects() and Database.add_rows() into fresh databases.
+
+    Parameters
+    ----------
+    n_users: int
+        Number of users
+
+    n_accounts: int
+        Number of accounts
+
+    n_transactions: int
+        Number of transactions
+
+    Returns
+    -------
+    rows_per_second: dict
+        Maps 'orm' and 'bulk' to the number of rows written per second, object/tuple creation included
+    """
+    rows = make_rows(n_users, n_accounts, n_transactions)
+    n_rows = n_users + n_accounts + n_transactions
+    result = dict()
+
+    with tempfile.TemporaryDirectory() as directory:
+        for mode in ('orm', 'bulk'):
+            database = Database(url=f'sqlite:///{os.path.join(directory, mode + ".db")}')
+
+            start = time.perf_counter()
+            if mode == 'orm':
+                database.add_objects(make_objects(rows))
+            else:
+                database.add_rows(**make_rows(n_users, n_accounts, n_transactions))
+            result[mode] = n_rows / (time.perf_counter() - start)
+
+            database.s.close()
+            database.engine.dispose()
+
+    return result
+
+
+if __name__ == '__main__':
+    for mode, speed in benchmark_write().items():
+        print(f'{mode:>5}: {speed:12,.0f} rows/s')
@@ -0,0 +1,313 @@
+import numpy as np
+import json
+import os
+
+# Columns of each table, stored as one .npy file per chunk and column
+tables = {
+    'transactions': {'id': np.int64, 'time': np.int64, 'src': np.int64, 'dst': np.int64, 'coin': np.int64,
+                     'amount': np.float64},
+    'accounts': {'id': np.int64, 'owner': np.int64, 'coin': np.int64},
+    'users': {'id': np.int64},
+}
+
+
+class ColumnarLog:
+    def __init__(self, path):
+        """
+        Append-only columnar store of a simulation. Each flush is appended as a chunk of fixed-width NumPy arrays:
+        transactions (id, time, src, dst, coin, amount) sorted by time with a per-turn offset index, plus the new
+        accounts (id, owner, coin) and users (id). Files are memory-mapped when read, so reading the transactions
+        of a range of turns only touches those rows. Miner gifts have src = -1.
+
+        Parameters
+        ----------
+        path: str
+            Directory of the log, created if it does not exist
+        """
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+        # Memory-mapped arrays, opened on first use
+        self.arrays = dict()
+        self.coins, self.chunks = [], []
+        self.reload()
+
+    def reload(self):
+        """
+        Reads the list of chunks again, e.g. to see the chunks appended by a running simulation
+        """
+        if os.path.exists(self.meta_file()):
+            with open(self.meta_file()) as f:
+                meta = json.load(f)
+            self.coins, self.chunks = meta['coins'], meta['chunks']
+
+    def meta_file(self):
+        return os.path.join(self.path, 'log.json')
+
+    def file(self, k, table, column):
+        return os.path.join(self.path, f'{k}.{table}.{column}.npy')
+
+    def __len__(self):
+        return sum(chunk['transactions'] for chunk in self.chunks)
+
+    def __repr__(self):
+        return f"ColumnarLog ({len(self.chunks)} chunks, {len(self)} transactions)"
+
+    def __str__(self):
+        return self.__repr__()
+
+    @property
+    def n_turns(self):
+        """
+        Number of turns covered by the log: every transaction has time < self.n_turns
+        """
+        return max((chunk['first_turn'] + len(chunk['offsets']) - 1 for chunk in self.chunks), default=0)
+
+    def clear(self):
+        """
+        Deletes every chunk of the log
+        """
+        for name in os.listdir(self.path):
+            if name.endswith('.npy') or name in ('log.json', 'log.json.tmp'):
+                os.remove(os.path.join(self.path, name))
+
+        self.coins, self.chunks, self.arrays = [], [], dict()
+
+    def append(self, columns, users=()):
+        """
+        Appends a flush as a new chunk.
+
+        Parameters
+        ----------
+        columns: list
+            Outputs of BlockSim.simulator.simulator.VectorCointSimulator.flush_columns(). Balance updates,
+            checkpoints and states are not stored, balances are computed from the transactions.
+
+        users: array_like
+            Ids of the users created since the last flush
+
+        Returns
+        -------
+        n_rows: int
+            Number of rows written
+        """
+        columns = [c for c in columns if c]
+        for coin_columns in columns:
+            if coin_columns['crypto_type'] not in self.coins:
+                self.coins.append(coin_columns['crypto_type'])
+        codes = [self.coins.index(c['crypto_type']) for c in columns]
+
+        def concatenate(arrays, dtype):
+            return np.concatenate([np.zeros(0, dtype=dtype)] + [np.asarray(a, dtype=dtype) for a in arrays])
+
+        trx = [c['transactions'] for c in columns]
+        data = {
+            'transactions': {
+                'id': concatenate([t[0] for t in trx], np.int64),
+                'amount': concatenate([t[1] for t in trx], np.float64),
+                'time': concatenate([t[2] for t in trx], np.int64),
+                'src': concatenate([t[3] for t in trx], np.int64),
+                'dst': concatenate([t[4] for t in trx], np.int64),
+                'coin': concatenate([np.full(len(t[0]), code) for t, code in zip(trx, codes)], np.int64),
+            },
+            'accounts': {
+                'id': concatenate([c['accounts'][0] for c in columns], np.int64),
+                'owner': concatenate([c['accounts'][1] for c in columns], np.int64),
+                'coin': concatenate([np.full(len(c['accounts'][0]), code) for c, code in zip(columns, codes)],
+                                    np.int64),
+            },
+            'users': {'id': np.asarray(users, dtype=np.int64).reshape(-1)},
+        }
+
+        # Rows of a turn are contiguous, turn t being offsets[t - first_turn]:offsets[t - first_turn + 1]
+        transactions = data['transactions']
+        order = np.argsort(transactions['time'], kind='stable')
+        for name in transactions:
+            transactions[name] = transactions[name][order]
+        first_turn = int(transactions['time'][0]) if len(order) > 0 else self.n_turns
+        last_turn = int(transactions['time'][-1]) if len(order) > 0 else first_turn - 1
+        offsets = np.searchsorted(transactions['time'], np.arange(first_turn, last_turn + 2))
+
+        sizes = {table: len(next(iter(data[table].values()))) for table in tables}
+        if not any(sizes.values()):
+            return 0
+
+        k = len(self.chunks)
+        for table, table_columns in data.items():
+            if sizes[table] > 0:
+                for name, values in table_columns.items():
+                    np.save(self.file(k, table, name), values)
+
+        self.chunks.append(dict(first_turn=first_turn, offsets=offsets.tolist(), **sizes))
+
+        # Readers of a running simulation reload the list of chunks at any time, it is replaced in one step
+        with open(self.meta_file() + '.tmp', 'w') as f:
+            json.dump({'coins': self.coins, 'chunks': self.chunks}, f)
+        os.replace(self.meta_file() + '.tmp', self.meta_file())
+
+        return sum(sizes.values())
+
+    def column(self, k, table, name):
+        """
+        Memory-mapped column of a chunk
+        """
+        key = (k, table, name)
+        if key not in self.arrays:
+            if self.chunks[k][table] > 0:
+                self.arrays[key] = np.load(self.file(k, table, name), mmap_mode='r')
+            else:
+                self.arrays[key] = np.zeros(0, dtype=tables[table][name])
+        return self.arrays[key]
+
+    def transactions(self, since=0, turn_number=None):
+        """
+        Reads the transactions with since <= time < turn_number, chunk by chunk, without copying them.
+
+        Parameters
+        ----------
+        since: int
+            First turn
+
+        turn_number: int
+            Transactions with time < turn_number are read, all of them by default
+
+        Yields
+        ------
+        columns: dict
+            Maps the names of tables['transactions'] to memory-mapped slices of a chunk
+        """
+        turn_number = self.n_turns if turn_number is None else turn_number
+        for k, chunk in enumerate(self.chunks):
+            offsets, first_turn = chunk['offsets'], chunk['first_turn']
+            start = offsets[min(max(since - first_turn, 0), len(offsets) - 1)]
+            stop = offsets[min(max(turn_number - first_turn, 0), len(offsets) - 1)]
+            if stop > start:
+                yield {name: self.column(k, 'transactions', name)[start:stop] for name in tables['transactions']}
+
+    def accounts(self):
+        """
+        Reads every account, chunk by chunk
+
+        Yields
+        ------
+        columns: dict
+            Maps the names of tables['accounts'] to memory-mapped arrays of a chunk
+        """
+        for k, chunk in enumerate(self.chunks):
+            if chunk['accounts'] > 0:
+                yield {name: self.column(k, 'accounts', name) for name in tables['accounts']}
+
+    def totals(self, since=0, turn_number=None):
+        """
+        Net flow of every account over the transactions with since <= time < turn_number
+
+        Returns
+        -------
+        totals: numpy.ndarray
+            Indexed by account id, rounded to 8 decimals like the balances of the simulator
+        """
+        size = max((int(c['id'].max()) for c in self.accounts()), default=0) + 1
+        totals = np.zeros(size, dtype=np.float64)
+        for trx in self.transactions(since, turn_number):
+            has_src = trx['src'] >= 0
+            totals += np.bincount(trx['dst'], weights=trx['amount'], minlength=size)
+            totals -= np.bincount(trx['src'][has_src], weights=trx['amount'][has_src], minlength=size)
+        return np.round(totals, 8)
+
+    def balances(self, turn_number, coins, since=0):
+        """
+        Same as BlockSim.finder.finder.stream_balances(), read from the log
+
+        Parameters
+        ----------
+        turn_number: int
+            Transactions with time < turn_number are taken into account
+
+        coins: list
+            Crypto names to load
+
+        since: int
+            Transactions with time < since are left out, which gives the change of the balances since that turn
+
+        Returns
+        -------
+        balances: dict
+            Maps each coin to a dictionary of account id to balance, accounts whose balance did not change are
+            left out
+        """
+        totals = self.totals(since, turn_number)
+
+        balances = {c: dict() for c in coins}
+        for acc in self.accounts():
+            moved = totals[acc['id']] != 0
+            ids, codes = acc['id'][moved], acc['coin'][moved]
+            for code, name in enumerate(self.coins):
+                if name in balances:
+                    sel = ids[codes == code]
+                    balances[name].update(zip(sel.tolist(), totals[sel].tolist()))
+
+        return balances
+
+    def owners(self, coins, after=0):
+        """
+        Same as BlockSim.finder.finder.account_owners(), read from the log
+
+        Returns
+        -------
+        (ids, owners): tuple
+            Account ids in increasing order and the id of their owner
+        """
+        codes = [self.coins.index(c) for c in coins if c in self.coins]
+        ids, owners = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+        for acc in self.accounts():
+            sel = np.isin(acc['coin'], codes) & (acc['id'] > after)
+            ids.append(acc['id'][sel])
+            owners.append(acc['owner'][sel])
+
+        ids, owners = np.concatenate(ids), np.concatenate(owners)
+        order = np.argsort(ids)
+        return ids[order], owners[order]
+
+    def export(self, database, chunk_size=50000):
+        """
+        Writes the log into the users, accounts and transactions tables of a database, in a single database
+        transaction. Account balances are the ones after the last transaction, rounded with round() like the ones
+        written by the simulator.
+
+        Parameters
+        ----------
+        database: BlockSim.orm.database.Database()
+            Database object, with empty tables
+
+        chunk_size: int
+            Number of rows built at once
+
+        Returns
+        -------
+        n_rows: int
+            Number of rows written
+        """
+        totals = self.totals()
+
+        def rows():
+            for k, chunk in enumerate(self.chunks):
+                if chunk['users'] > 0:
+                    yield dict(users=[(u_id,) for u_id in self.column(k, 'users', 'id').tolist()])
+
+                if chunk['accounts'] > 0:
+                    ids = self.column(k, 'accounts', 'id')
+                    names = [self.coins[code] for code in self.column(k, 'accounts', 'coin').tolist()]
+                    balances = [round(balance, 8) for balance in totals[ids].tolist()]
+                    yield dict(accounts=list(zip(ids.tolist(), self.column(k, 'accounts', 'owner').tolist(), names,
+                                                 balances)))
+
+                for start in range(0, chunk['transactions'], chunk_size):
+                    trx = {name: self.column(k, 'transactions', name)[start:start + chunk_size]
+                           for name in ('id', 'amount', 'time', 'src', 'dst')}
+                    src = trx['src'].tolist()
+                    for i in np.flatnonzero(trx['src'] < 0).tolist():
+                        src[i] = None
+                    yield dict(transactions=list(zip(trx['id'].tolist(), trx['amount'].tolist(),
+                                                     trx['time'].tolist(), src, trx['dst'].tolist())))
+
+        return database.add_row_chunks(rows())
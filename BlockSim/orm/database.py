@@ -1,5 +1,5 @@
 import sqlalchemy as db
-from sqlalchemy import Column, Integer, String, ForeignKey, Float
+from sqlalchemy import Column, Integer, String, ForeignKey, Float, LargeBinary
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from BlockSim import settings
@@ -65,10 +65,88 @@ class Transaction(Base):
         return self.__repr__()
 
 
+class BalanceCheckpoint(Base):
+    __tablename__ = 'balance_checkpoints'
+
+    # Balances after every transaction with time < turn, the same convention as Finder's turn_number
+    turn = Column(Integer, primary_key=True)
+    account_id = Column(Integer, ForeignKey('accounts.id'), primary_key=True)
+    balance = Column(Float)
+
+    def __repr__(self):
+        return f'Checkpoint (turn: {self.turn}, account: {self.account_id}) [balance={self.balance}]'
+
+    def __str__(self):
+        return self.__repr__()
+
+
+class SimulatorState(Base):
+    __tablename__ = 'simulator_states'
+
+    # Pickled state of the simulator of a coin, written with the balance checkpoint of the same turn
+    turn = Column(Integer, primary_key=True)
+    crypto_type = Column(String, primary_key=True)
+    state = Column(LargeBinary)
+
+    def __repr__(self):
+        return f'Simulator state (turn: {self.turn}, type={self.crypto_type})'
+
+    def __str__(self):
+        return self.__repr__()
+
+
+# Statement and parameter names of each keyword argument of Database.add_rows(), in the order of the tuples
+row_statements = {
+    'users': (db.insert(User.__table__), ('id',)),
+    'accounts': (db.insert(Account.__table__), ('id', 'owner_id', 'crypto_type', 'balance')),
+    'transactions': (db.insert(Transaction.__table__), ('id', 'amount', 'time', 'src', 'dst')),
+    'balances': (db.update(Account.__table__).where(Account.__table__.c.id == db.bindparam('account_id'))
+                 .values(balance=db.bindparam('new_balance')), ('new_balance', 'account_id')),
+    'checkpoints': (db.insert(BalanceCheckpoint.__table__), ('turn', 'account_id', 'balance')),
+    'states': (db.insert(SimulatorState.__table__), ('turn', 'crypto_type', 'state')),
+}
+
+
+def execute_rows(connection, name, rows):
+    """
+    Runs the statement of row_statements[name] for every row with one executemany of the driver. The statement is
+    compiled for the dialect of the connection. Drivers taking positional parameters get the tuples as they are,
+    which skips the per-row parameter processing of SQLAlchemy, the others get one dictionary per row.
+
+    Parameters
+    ----------
+    connection: sqlalchemy.engine.Connection
+        Connection in a database transaction
+
+    name: str
+        Key of row_statements
+
+    rows: list
+        Tuples in the order of the parameter names of row_statements[name]
+    """
+    statement, columns = row_statements[name]
+    compiled = statement.compile(dialect=connection.dialect, column_keys=list(columns))
+
+    if compiled.positional:
+        order = [columns.index(key) for key in compiled.positiontup]
+        if order != list(range(len(columns))):
+            rows = [tuple(row[i] for i in order) for row in rows]
+        parameters = list(rows)
+    else:
+        parameters = [dict(zip(columns, row)) for row in rows]
+
+    connection.exec_driver_sql(str(compiled), parameters)
+
+
 class Database:
-    def __init__(self):
-        self.engine = db.create_engine(settings.database_url,
-                                       connect_args={'check_same_thread': False},
+    def __init__(self, url=None):
+        if url is None:
+            url = settings.database_url
+
+        # check_same_thread is an option of the SQLite driver only
+        connect_args = {'check_same_thread': False} if db.engine.make_url(url).get_backend_name() == 'sqlite' else {}
+        self.engine = db.create_engine(url,
+                                       connect_args=connect_args,
                                        echo=False)
 
         self.session = sessionmaker()
@@ -76,12 +154,181 @@ class Database:
 
         Base.metadata.create_all(self.engine)
         self.s = self.session()
+        self.next_ids = dict()
 
     def add_objects(self, objects):
         self.s.add_all(objects)
         self.s.commit()
         return True
 
+    def reserve_ids(self, table, n):
+        """
+        Reserve n consecutive primary keys of a table, so rows can be built before they are inserted.
+        A table filled with reserved ids should not receive rows with autoincrement ids at the same time.
+
+        Parameters
+        ----------
+        table: type
+            ORM class of the table, e.g. BlockSim.orm.database.Account
+
+        n: int
+            Number of ids to reserve
+
+        Returns
+        -------
+        ids: range
+            Reserved ids
+        """
+        name = table.__tablename__
+        if name not in self.next_ids:
+            with self.engine.connect() as connection:
+                max_id = connection.execute(db.select(db.func.max(table.id))).scalar()
+            self.next_ids[name] = (max_id or 0) + 1
+
+        start = self.next_ids[name]
+        self.next_ids[name] += n
+        return range(start, start + n)
+
+    def add_rows(self, users=(), accounts=(), transactions=(), balances=(), checkpoints=(), states=()):
+        """
+        Bulk-load rows as plain tuples with one executemany per table, in a single database transaction.
+        Primary keys must be part of the rows, see self.reserve_ids().
+
+        Parameters
+        ----------
+        users: list
+            Tuples of (id,)
+
+        accounts: list
+            Tuples of (id, owner_id, crypto_type, balance)
+
+        transactions: list
+            Tuples of (id, amount, time, src, dst)
+
+        balances: list
+            Tuples of (balance, id) updating the balance of already inserted accounts
+
+        checkpoints: list
+            Tuples of (turn, account_id, balance), see BalanceCheckpoint
+
+        states: list
+            Tuples of (turn, crypto_type, state), see SimulatorState
+
+        Returns
+        -------
+        n_rows: int
+            Number of rows written
+        """
+        return self.add_row_chunks([dict(users=users, accounts=accounts, transactions=transactions,
+                                         balances=balances, checkpoints=checkpoints, states=states)])
+
+    def add_row_chunks(self, chunks):
+        """
+        Same as self.add_rows(), for an iterable of its keyword arguments, written in a single database transaction.
+        Chunks can be built lazily, so only the rows of one chunk have to be in memory at a time.
+
+        Parameters
+        ----------
+        chunks: iterable
+            Dictionaries of keyword arguments of self.add_rows()
+
+        Returns
+        -------
+        n_rows: int
+            Number of rows written
+        """
+        n_rows = 0
+        with self.engine.begin() as connection:
+            for chunk in chunks:
+                for table in row_statements:
+                    rows = chunk.get(table, ())
+                    if len(rows) > 0:
+                        execute_rows(connection, table, rows)
+                        n_rows += len(rows)
+
+        return n_rows
+
+    def checkpoint_turns(self):
+        """
+        Returns the sorted list of turns having a balance checkpoint
+        """
+        with self.engine.connect() as connection:
+            query = db.select(BalanceCheckpoint.turn).distinct().order_by(BalanceCheckpoint.turn)
+            return [turn for turn, in connection.execute(query)]
+
+    def simulator_states(self):
+        """
+        Returns the simulator states of the latest turn having any
+
+        Returns
+        -------
+        (turn, states): tuple
+            Turn and dictionary mapping crypto names to their pickled state, (None, {}) if there is no state
+        """
+        with self.engine.connect() as connection:
+            turn = connection.execute(db.select(db.func.max(SimulatorState.turn))).scalar()
+            query = db.select(SimulatorState.crypto_type, SimulatorState.state).where(SimulatorState.turn == turn)
+            return turn, {crypto_type: state for crypto_type, state in connection.execute(query)}
+
+    def clear(self):
+        """
+        Deletes every row of every table, in a single database transaction
+
+        Returns
+        -------
+        n_rows: int
+            Number of deleted rows
+        """
+        n_rows = 0
+        with self.engine.begin() as connection:
+            # Children first, so foreign keys never point to deleted rows
+            for table in reversed(Base.metadata.sorted_tables):
+                n_rows += connection.execute(table.delete()).rowcount
+
+        self.next_ids.clear()
+        return n_rows
+
+    def truncate(self, turn, last_user, last_account, balances=()):
+        """
+        Deletes everything written after the simulator states of a turn, in a single database transaction:
+        transactions with time >= turn, later checkpoints and states, and users and accounts with larger ids.
+
+        Parameters
+        ----------
+        turn: int
+            Turn of the kept states
+
+        last_user: int
+            Largest user id to keep
+
+        last_account: int
+            Largest account id to keep
+
+        balances: list
+            Tuples of (balance, id) restoring the balance of the kept accounts
+
+        Returns
+        -------
+        n_rows: int
+            Number of deleted rows
+        """
+        statements = [
+            db.delete(Transaction.__table__).where(Transaction.time >= turn),
+            db.delete(BalanceCheckpoint.__table__).where(BalanceCheckpoint.turn > turn),
+            db.delete(SimulatorState.__table__).where(SimulatorState.turn > turn),
+            db.delete(Account.__table__).where(Account.id > last_account),
+            db.delete(User.__table__).where(User.id > last_user),
+        ]
+
+        n_rows = 0
+        with self.engine.begin() as connection:
+            for statement in statements:
+                n_rows += connection.execute(statement).rowcount
+            if len(balances) > 0:
+                execute_rows(connection, 'balances', balances)
+
+        return n_rows
+
     def __del__(self):
         self.s.close()
         self.session.close_all()
@@ -0,0 +1,145 @@
+from BlockSim.settings import fork_context
+import traceback
+import queue
+
+
+def write_batches(database, batches, connection, prepare, chunked):
+    """
+    Process loop of BackgroundWriter: writes the queued batches until it gets None, then sends back the number of
+    written rows and closes the connection. A failure is sent back as a traceback as soon as it happens.
+    """
+    # Pooled connections were opened by the parent process, they must not be used or closed here
+    database.engine.dispose(close=False)
+
+    n_rows, failed = 0, False
+    while True:
+        batch = batches.get()
+        if batch is None:
+            break
+
+        # After a failure, batches are only consumed so that producers never block forever
+        if failed:
+            continue
+
+        try:
+            rows = batch if prepare is None else prepare(batch)
+            if chunked:
+                n_rows += database.add_row_chunks(rows)
+            else:
+                n_rows += database.add_rows(**rows)
+        except BaseException:
+            failed = True
+            connection.send(traceback.format_exc())
+
+    connection.send(n_rows)
+    connection.close()
+
+
+class BackgroundWriter:
+    def __init__(self, database, max_batches=4, prepare=None, chunked=False):
+        """
+        Writes row batches in a dedicated process, so the simulation can go on while the previous batch is built
+        and committed. Building the rows and binding them in the database driver hold the GIL, so a thread would
+        not overlap them with the simulation. Each batch is written with BlockSim.orm.database.Database.add_rows(),
+        on a connection of the writer process.
+
+        Parameters
+        ----------
+        database: BlockSim.orm.database.Database()
+            Database object
+
+        max_batches: int
+            Maximum number of batches waiting to be written. self.put() blocks when the queue is full.
+
+        prepare: callable
+            Optional function turning a queued batch into keyword arguments of Database.add_rows(). It runs in the
+            writer process, which keeps the row building off the producer.
+
+        chunked: bool
+            Batches (or the outputs of prepare) are iterables of keyword arguments of Database.add_rows(), written
+            with Database.add_row_chunks()
+        """
+        # prepare may be a closure, so the writer is forked rather than spawned
+        context = fork_context('BackgroundWriter')
+
+        self.queue = context.Queue(maxsize=max_batches)
+        self.connection, child = context.Pipe(duplex=False)
+        self.error = None
+        self.n_rows = 0
+
+        self.process = context.Process(target=write_batches, name='BlockSim-writer', daemon=True,
+                                       args=(database, self.queue, child, prepare, chunked))
+        self.process.start()
+        child.close()
+
+    def receive(self):
+        """
+        Reads one message of the writer process, returns False once the process has closed the connection
+        """
+        try:
+            message = self.connection.recv()
+        except EOFError:
+            return False
+
+        if isinstance(message, str):
+            self.error = message
+        else:
+            self.n_rows = message
+        return True
+
+    def check(self):
+        """
+        Raises the error of a failed write, if any.
+        """
+        while self.error is None and self.connection.poll() and self.receive():
+            pass
+
+        if self.error is not None:
+            raise RuntimeError(f'Background writer failed:\n{self.error}')
+
+    def put(self, batch):
+        """
+        Queues a batch, waiting while the queue is full.
+
+        Parameters
+        ----------
+        batch: object
+            Keyword arguments of BlockSim.orm.database.Database.add_rows(), or the input of prepare
+        """
+        self.check()
+        while True:
+            try:
+                self.queue.put(batch, timeout=1)
+                return
+            except queue.Full:
+                if not self.process.is_alive():
+                    raise RuntimeError(f'Background writer exited with code {self.process.exitcode}')
+
+    def stop(self):
+        """
+        Writes the remaining batches and stops the process.
+        """
+        if self.process.is_alive():
+            self.queue.put(None)
+
+        # The process sends its error, if any, then the number of written rows, and closes the connection
+        while self.receive():
+            pass
+        self.process.join()
+
+    def close(self):
+        """
+        Same as self.stop(), then raises the error of a failed write, if any.
+        """
+        self.stop()
+        self.check()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # Do not hide an error of the producer behind one of the writer
+        if exc_type is None:
+            self.close()
+        else:
+            self.stop()
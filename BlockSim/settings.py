@@ -1,4 +1,21 @@
+import multiprocessing
 import os
 
 root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 database_url = f'sqlite:///{os.path.join(root_dir, "database.db")}'
+
+
+def fork_context(feature):
+    """
+    Returns the 'fork' multiprocessing context. Worker processes of BlockSim inherit closures and large objects from
+    their parent, which the 'spawn' start method cannot pickle, so features using them need fork.
+
+    Parameters
+    ----------
+    feature: str
+        Name of the feature, for the error raised where fork is not available (e.g. on Windows)
+    """
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        raise RuntimeError(f"{feature} needs the 'fork' start method of multiprocessing, which this platform "
+                           f"does not provide")
+    return multiprocessing.get_context('fork')
@@ -0,0 +1,91 @@
+from BlockSim.orm.database import Account, Database, Transaction
+from BlockSim.simulator.run import setup
+import sqlalchemy as sa
+import multiprocessing
+import contextlib
+import tracemalloc
+import tempfile
+import resource
+import os
+
+modes = {
+    'orm': dict(engine='numpy', write_mode='orm'),
+    'bulk': dict(engine='numpy', write_mode='bulk'),
+    'low_memory': dict(engine='numpy', write_mode='bulk', low_memory=True),
+}
+
+
+def measure(connection, kwargs):
+    """
+    Process of benchmark_memory(): runs setup() with tracemalloc on, then sends back the peak of traced memory,
+    the peak resident set size and the number of accounts and transactions of the database
+    """
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+        tracemalloc.start()
+        setup(**kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    # ru_maxrss is in kilobytes on Linux
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    database = Database(url=kwargs['url'])
+    with database.engine.connect() as c:
+        n_accounts = c.execute(sa.select(sa.func.count()).select_from(Account.__table__)).scalar()
+        n_transactions = c.execute(sa.select(sa.func.count()).select_from(Transaction.__table__)).scalar()
+    database.engine.dispose()
+
+    connection.send(dict(peak=peak, max_rss=max_rss, accounts=n_accounts, transactions=n_transactions))
+    connection.close()
+
+
+def benchmark_memory(max_turns=(50, 100, 200), n_coins=3, names=('bulk', 'low_memory'), seed=0):
+    """
+    Runs the same simulation for an increasing number of turns in each mode, every run in a fresh process.
+
+    Parameters
+    ----------
+    max_turns: tuple
+        Numbers of turns to simulate
+
+    n_coins: int
+        Number of coins
+
+    names: tuple
+        Keys of modes to compare. The 'orm' mode builds ORM objects for every row and is much slower.
+
+    seed: int
+        Master seed of the simulations
+
+    Returns
+    -------
+    result: dict
+        Maps (mode, max_turn) to the peak traced memory ('peak', bytes), the peak resident set size ('max_rss',
+        bytes) and the number of 'accounts' and 'transactions'
+    """
+    context = multiprocessing.get_context('spawn')
+    result = dict()
+
+    with tempfile.TemporaryDirectory() as directory:
+        for name in names:
+            for max_turn in max_turns:
+                url = f'sqlite:///{os.path.join(directory, f"{name}-{max_turn}.db")}'
+                kwargs = dict(modes[name], max_turn=max_turn, n_coins=n_coins, seed=seed, url=url)
+
+                parent, child = context.Pipe()
+                process = context.Process(target=measure, args=(child, kwargs))
+                process.start()
+                child.close()
+                result[name, max_turn] = parent.recv()
+                process.join()
+
+    return result
+
+
+if __name__ == '__main__':
+    print(f'{"mode":>10} {"turns":>6} {"accounts":>9} {"transactions":>13} {"peak MB":>8} {"RSS MB":>7} '
+          f'{"B/account":>10} {"B/transaction":>14}')
+    for (mode, max_turn), m in benchmark_memory().items():
+        print(f'{mode:>10} {max_turn:>6} {m["accounts"]:>9,} {m["transactions"]:>13,} {m["peak"] / 2 ** 20:>8.1f} '
+              f'{m["max_rss"] / 2 ** 20:>7.1f} {m["peak"] / m["accounts"]:>10.0f} '
+              f'{m["peak"] / m["transactions"]:>14.1f}')
@@ -0,0 +1,163 @@
+import random
+import numpy as np
+
+
+def grow(arr, size, fill=0):
+    """
+    Returns arr with capacity for at least size elements, doubling the capacity when it runs out.
+    New elements are set to fill.
+    """
+    if size <= len(arr):
+        return arr
+
+    new_arr = np.full(max(size, 2 * len(arr)), fill, dtype=arr.dtype)
+    new_arr[:len(arr)] = arr
+    return new_arr
+
+
+class SampleableSet:
+    def __init__(self):
+        """
+        Set of non-negative integers (e.g. list indices) supporting O(1) insertion, removal and uniform sampling.
+        Members are kept in a swap-remove array and a position map indexed by the member itself.
+        """
+        self.n = 0
+        self.members = np.zeros(0, dtype=np.int64)
+        self.positions = np.zeros(0, dtype=np.int64)
+
+    @classmethod
+    def from_members(cls, members):
+        """
+        Builds a set holding members in this exact order, e.g. saved from self.members[:len(self)], so that it
+        samples the same way
+        """
+        keys = cls()
+        keys.n = len(members)
+        keys.members = np.array(members, dtype=np.int64)
+        keys.positions = np.full(int(keys.members.max(initial=-1)) + 1, -1, dtype=np.int64)
+        keys.positions[keys.members] = np.arange(keys.n)
+        return keys
+
+    def __len__(self):
+        return self.n
+
+    def __contains__(self, key):
+        return 0 <= key < len(self.positions) and self.positions[key] >= 0
+
+    def __iter__(self):
+        return iter(self.members[:self.n].tolist())
+
+    def add(self, key):
+        if key >= len(self.positions):
+            self.positions = grow(self.positions, key + 1, fill=-1)
+        if self.positions[key] >= 0:
+            return
+
+        self.members = grow(self.members, self.n + 1)
+        self.members[self.n] = key
+        self.positions[key] = self.n
+        self.n += 1
+
+    def discard(self, key):
+        if key not in self:
+            return
+
+        position, last = self.positions[key], self.members[self.n - 1]
+        self.members[position] = last
+        self.positions[last] = position
+        self.positions[key] = -1
+        self.n -= 1
+
+    def update(self, keys):
+        """
+        Adds all keys, ignoring the ones that are already members.
+
+        Parameters
+        ----------
+        keys: array_like
+            Non-negative integers
+        """
+        keys = np.unique(np.asarray(keys, dtype=np.int64))
+        if len(keys) < 1:
+            return
+
+        self.positions = grow(self.positions, int(keys[-1]) + 1, fill=-1)
+        keys = keys[self.positions[keys] < 0]
+
+        size = self.n + len(keys)
+        self.members = grow(self.members, size)
+        self.members[self.n:size] = keys
+        self.positions[keys] = np.arange(self.n, size)
+        self.n = size
+
+    def difference_update(self, keys):
+        """
+        Removes all keys, ignoring the ones that are not members. The last members are moved into the freed slots.
+
+        Parameters
+        ----------
+        keys: array_like
+            Non-negative integers
+        """
+        keys = np.unique(np.asarray(keys, dtype=np.int64))
+        keys = keys[keys < len(self.positions)]
+        keys = keys[self.positions[keys] >= 0]
+        if len(keys) < 1:
+            return
+
+        size = self.n - len(keys)
+        freed = self.positions[keys]
+        freed = freed[freed < size]
+        self.positions[keys] = -1
+
+        tail = self.members[size:self.n]
+        movers = tail[self.positions[tail] >= 0]
+
+        self.members[freed] = movers
+        self.positions[movers] = freed
+        self.n = size
+
+    def choices(self, k=1, rnd=random):
+        """
+        Draws k members uniformly with replacement using the standard library random generator.
+
+        Parameters
+        ----------
+        k: int
+            Number of draws
+
+        rnd: random.Random
+            Random generator, the global random module by default
+
+        Returns
+        -------
+        keys: list
+            Drawn members
+        """
+        if self.n < 1 and k > 0:
+            raise IndexError('Cannot choose from an empty sequence')
+
+        members = self.members
+        return [int(members[rnd.randrange(self.n)]) for _ in range(k)]
+
+    def sample(self, rng, k=1):
+        """
+        Same as self.choices(), but draws with a NumPy generator and returns an array.
+
+        Parameters
+        ----------
+        rng: numpy.random.Generator
+            Random generator
+
+        k: int
+            Number of draws
+
+        Returns
+        -------
+        keys: numpy.ndarray
+            Drawn members
+        """
+        if self.n < 1 and k > 0:
+            raise IndexError('Cannot choose from an empty sequence')
+
+        return self.members[rng.integers(0, self.n, k)]
@@ -0,0 +1,163 @@
+from BlockSim.simulator.simulator import AccountIds, VectorCointSimulator
+from BlockSim.settings import fork_context
+import traceback
+import pickle
+
+
+def coin_worker(connection, configs, seeds):
+    """
+    Process loop of ParallelCoins: simulates the given coins for each received list of user counts, one count per
+    turn, and sends back the output of VectorCointSimulator.flush_local() of every coin. With a checkpoint, it also
+    holds the output of VectorCointSimulator.get_state() as 'state'.
+    """
+    try:
+        simulators = [VectorCointSimulator(conf=cfg, seed=seed) for cfg, seed in zip(configs, seeds)]
+
+        while True:
+            message = connection.recv()
+            if message is None:
+                break
+
+            user_counts, checkpoint = message
+            for n_users in user_counts:
+                for simulator in simulators:
+                    # Owners are drawn as positions in the user list, the main process maps them to user ids
+                    simulator.turn(user_list=range(n_users))
+
+            outputs = []
+            for simulator in simulators:
+                local = simulator.flush_local(checkpoint=checkpoint)
+                if checkpoint:
+                    local['state'] = simulator.get_state()
+                outputs.append(local)
+            connection.send(outputs)
+    except Exception:
+        connection.send(traceback.format_exc())
+    finally:
+        connection.close()
+
+
+class ParallelCoins:
+    def __init__(self, configs, seeds, workers, database):
+        """
+        Runs one VectorCointSimulator per coin in a pool of worker processes. Coins are spread round-robin over
+        the workers, and each coin keeps its own random stream, so the outcome does not depend on the number of
+        workers. Workers report the owners of new accounts as positions in the user list, and primary keys are
+        reserved here in coin order, so the database is the same as the one of the sequential numpy engine.
+
+        Parameters
+        ----------
+        configs: list
+            Coin configs, as returned by BlockSim.simulator.run.load_configs()
+
+        seeds: list
+            One seed (int or numpy.random.SeedSequence) per coin
+
+        workers: int
+            Number of worker processes
+
+        database: BlockSim.orm.database.Database()
+            Database object, which hands out the primary keys
+        """
+        # Configs hold closures, so workers are forked rather than spawned
+        context = fork_context('ParallelCoins')
+        workers = max(1, min(workers, len(configs)))
+
+        self.n_coins = len(configs)
+        self.id_maps = [AccountIds(database) for _ in configs]
+        self.user_counts = []
+        self.assignment = [list(range(self.n_coins))[w::workers] for w in range(workers)]
+        self.connections, self.processes = [], []
+
+        for coins in self.assignment:
+            parent, child = context.Pipe()
+            process = context.Process(target=coin_worker, daemon=True,
+                                      args=(child, [configs[c] for c in coins], [seeds[c] for c in coins]))
+            process.start()
+            child.close()
+            self.connections.append(parent)
+            self.processes.append(process)
+
+    def run(self, user_counts, checkpoint=False):
+        """
+        Simulates the next turns on every coin.
+
+        Parameters
+        ----------
+        user_counts: list
+            Total number of users at each turn
+
+        checkpoint: bool
+            Also take a snapshot of the funded accounts after the last turn
+
+        Returns
+        -------
+        local: list
+            Output of VectorCointSimulator.flush_local(), in coin order
+        """
+        for connection in self.connections:
+            connection.send((user_counts, checkpoint))
+
+        result = [None] * self.n_coins
+        for coins, connection in zip(self.assignment, self.connections):
+            output = connection.recv()
+            if isinstance(output, str):
+                raise RuntimeError(f'Coin worker failed:\n{output}')
+
+            for c, local in zip(coins, output):
+                result[c] = local
+
+        return result
+
+    def turn(self, user_list):
+        """
+        Schedules the next turn of every coin, simulated by the workers at the next self.flush_columns()
+
+        Parameters
+        ----------
+        user_list: list
+            User ids, the list is expected to only grow between turns
+        """
+        self.user_counts.append(len(user_list))
+
+    def flush_columns(self, user_list, checkpoint=False):
+        """
+        Simulates the scheduled turns and collects them like VectorCointSimulator.flush_columns() of every coin.
+
+        Parameters
+        ----------
+        user_list: list
+            User ids, indexed by the owners of the new accounts
+
+        checkpoint: bool
+            Also take a snapshot of the funded accounts after the last turn, and of the simulators for the
+            simulator_states table
+
+        Returns
+        -------
+        columns: list
+            Output of VectorCointSimulator.flush_columns(), in coin order
+        """
+        local = self.run(self.user_counts, checkpoint=checkpoint)
+        self.user_counts = []
+
+        columns = []
+        for id_map, coin_local in zip(self.id_maps, local):
+            coin_columns = id_map.to_columns(coin_local, user_list)
+            if 'state' in coin_local:
+                # Workers know neither the account ids nor the user ids, the state gets the ones of this process
+                state = dict(coin_local['state'], ids=id_map.ids[:id_map.n].copy(), user_list=user_list)
+                coin_columns['state'] = (coin_local['checkpoint'][0], pickle.dumps(state, pickle.HIGHEST_PROTOCOL))
+            columns.append(coin_columns)
+        return columns
+
+    def close(self):
+        for connection in self.connections:
+            try:
+                connection.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+            connection.close()
+
+        for process in self.processes:
+            process.join()
@@ -1,9 +1,17 @@
-from BlockSim.simulator.simulator import CointSimulator
+from BlockSim.simulator.simulator import CointSimulator, VectorCointSimulator, columns_to_rows, round_balances, \
+    split_columns
+from BlockSim.simulator.parallel import ParallelCoins
 from BlockSim.orm.database import Database, User
-from BlockSim.settings import root_dir
+from BlockSim.orm.writer import BackgroundWriter
+from BlockSim.orm.columnar import ColumnarLog
+from BlockSim.settings import fork_context, root_dir
 import BlockSim.config_files as cf
+from collections import defaultdict
 from tqdm import tqdm
+import numpy as np
 import datetime
+import random
+import pickle
 import json
 import os
 
@@ -31,60 +39,340 @@ def load_configs():
     return configs
 
 
-def new_user_at_turn(t, simulators):
-    return sum(int(s.config['new_accounts'](t)) for s in simulators)
+def new_user_at_turn(t, configs):
+    return sum(int(cfg['new_accounts'](t)) for cfg in configs)
 
 
-def setup(max_turn=1000, n_coins=3, verbose=False):
+engines = {
+    'orm': CointSimulator,
+    'numpy': VectorCointSimulator,
+}
+
+
+def merge_rows(batches):
+    """
+    Merges the outputs of BlockSim.simulator.simulator.columns_to_rows() into one set of keyword arguments
+    for BlockSim.orm.database.Database.add_rows()
+    """
+    rows = defaultdict(list)
+    for batch in batches:
+        for table, table_rows in batch.items():
+            rows[table] += table_rows
+    return rows
+
+
+def batch_rows(batch):
+    """
+    Turns a (user_rows, columns) batch built by setup() into keyword arguments
+    for BlockSim.orm.database.Database.add_rows()
+    """
+    user_rows, columns = batch
+    rows = merge_rows(columns_to_rows(c) for c in columns)
+    rows['users'] = user_rows
+    return rows
+
+
+def batch_row_chunks(batch, chunk_size=50000):
+    """
+    Same as batch_rows(), but builds the rows lazily in chunks of at most chunk_size transactions, for
+    BlockSim.orm.database.Database.add_row_chunks()
+    """
+    user_rows, columns = batch
+    yield dict(users=user_rows)
+    for coin_columns in columns:
+        for part in split_columns(coin_columns, chunk_size):
+            yield columns_to_rows(part)
+
+
+def setup(max_turn=1000, n_coins=3, verbose=False, engine='orm', write_mode='orm', pipelined=False, seed=None,
+          workers=None, checkpoint_every=None, on_flush=None, low_memory=False, url=None, resume=False,
+          log_path=None):
+    """
+    Runs the simulation and stores it in database.db
+
+    Parameters
+    ----------
+    max_turn: int
+        Number of turns to simulate
+
+    n_coins: int
+        Number of coins taken from BlockSim.config_files.coins.json
+
+    verbose: bool
+        Verbose printing details
+
+    engine: str
+        'orm' to simulate with CointSimulator, 'numpy' to simulate with VectorCointSimulator
+
+    write_mode: str
+        'orm' to write through the session with Database.add_objects(), 'bulk' to write plain tuples with
+        Database.add_rows(). The bulk mode requires the numpy engine.
+
+    pipelined: bool
+        Hand flushed batches to a BlockSim.orm.writer.BackgroundWriter process, which builds the rows and commits
+        them while the simulation goes on. Overlapping needs a second CPU. Requires the bulk write mode.
+
+    seed: int
+        Master seed. The numpy engine derives one random stream per coin from it, the orm engine seeds the global
+        random module.
+
+    workers: int
+        Simulate the coins in this many worker processes (see BlockSim.simulator.parallel.ParallelCoins). Requires the
+        bulk write mode. For a given seed, the database is the same as the one of the sequential numpy engine.
+
+    checkpoint_every: int
+        Store a snapshot of every funded balance in the balance_checkpoints table after the turns that are a
+        multiple of checkpoint_every and after the last turn, which are flushed for it besides the flushes every 10
+        turns. Finder starts from them. In the bulk write mode, the state of every simulator is saved with them, in
+        the same database transaction.
+
+    on_flush: callable
+        Called after every flush as on_flush(db, turn_number, columns), where transactions with time < turn_number
+        have been flushed. In the bulk write mode, columns are the outputs of VectorCointSimulator.flush_columns(),
+        which may not be committed yet when pipelined. In the orm write mode, columns is None and the rows are
+        committed. See BlockSim.finder.finder.Finder.follow().
+
+    low_memory: bool
+        Build and write the rows of each flush in chunks (see batch_row_chunks()) instead of all at once. Memory
+        then depends on the number of accounts, not on the number of transactions of a flush. Requires the bulk
+        write mode.
+
+    url: str
+        Database url, by default database.db is deleted and created again. Unless resuming or writing a log, the
+        tables of an existing database are emptied first.
+
+    resume: bool
+        Go on with the simulation of the database from its latest simulator state, up to max_turn, instead of
+        starting a new one. Rows written after that state are deleted first. The coins and the random streams are
+        the ones of the saved states, so n_coins and seed are ignored. Requires the bulk write mode without
+        workers. See resume().
+
+    log_path: str
+        Append the flushes to a new BlockSim.orm.columnar.ColumnarLog in this directory instead of writing them to
+        the database given by url, which then only hands out the ids and is left as is: the ids go on after its
+        rows. Balance checkpoints and simulator states cannot be stored, so checkpoint_every is rejected. Export the
+        log to a database with ColumnarLog.export(). Requires the bulk write mode and url.
+    """
+    if engine not in engines:
+        raise ValueError(f"Unknown engine '{engine}', expected one of {list(engines.keys())}")
+
+    if write_mode not in ('orm', 'bulk'):
+        raise ValueError(f"Unknown write_mode '{write_mode}', expected 'orm' or 'bulk'")
+
+    if write_mode == 'bulk' and engine != 'numpy':
+        raise ValueError("write_mode='bulk' requires engine='numpy'")
+
+    if pipelined and write_mode != 'bulk':
+        raise ValueError("pipelined=True requires write_mode='bulk'")
+
+    if workers is not None and write_mode != 'bulk':
+        raise ValueError("workers requires write_mode='bulk'")
+
+    if low_memory and write_mode != 'bulk':
+        raise ValueError("low_memory=True requires write_mode='bulk'")
+
+    if resume and (write_mode != 'bulk' or workers is not None):
+        raise ValueError("resume=True requires write_mode='bulk' without workers")
+
+    if log_path is not None and (write_mode != 'bulk' or pipelined or resume or checkpoint_every is not None):
+        raise ValueError("log_path requires write_mode='bulk', without pipelined, resume or checkpoint_every")
+
+    if log_path is not None and url is None:
+        raise ValueError("log_path requires the url of the database handing out the ids")
+
+    # Platforms without fork fail here, before the database of a previous run is cleared
+    if pipelined:
+        fork_context('pipelined=True')
+    if workers is not None:
+        fork_context('workers')
+
     configs = load_configs()
 
-    if len(configs) < n_coins:
-        raise ImportError("Not enough configs found in BlockSim.config_files.coins.json "
-                          f"[found {len(configs)} configs] [But asked n_coins={n_coins}]")
+    if resume:
+        db = Database(url=url)
+        state_turn, states = db.simulator_states()
+        if state_turn is None:
+            raise ValueError('No simulator state found in the database, states are saved with checkpoint_every')
+
+        # Coins keep the order of coins.json, which is the order their ids are reserved in
+        configs = [cfg for cfg in configs if cfg['crypto_name'] in states]
+        if len(configs) < len(states):
+            raise ImportError("Not all the coins of the simulator states were found in "
+                              f"BlockSim.config_files.coins.json [states of {list(states.keys())}]")
+    else:
+        if len(configs) < n_coins:
+            raise ImportError("Not enough configs found in BlockSim.config_files.coins.json "
+                              f"[found {len(configs)} configs] [But asked n_coins={n_coins}]")
+
+        configs = configs[:n_coins]
 
-    configs = configs[:n_coins]
+        if url is None and os.path.exists(os.path.join(root_dir, 'database.db')):
+            os.remove(os.path.join(root_dir, 'database.db'))
 
-    if os.path.exists(os.path.join(root_dir, 'database.db')):
-        os.remove(os.path.join(root_dir, 'database.db'))
+        # A database given by url may hold a previous run. In log mode, it only hands out the ids and is kept.
+        db = Database(url=url)
+        if log_path is None:
+            db.clear()
 
-    db = Database()
+    seeds = np.random.SeedSequence(seed).spawn(len(configs))
 
-    all_users = []
-    simulators = [CointSimulator(conf=cfg, database=db) for cfg in configs]
+    # Coin workers are forked before the writer process, so they do not inherit its queue and pipe
+    coins = ParallelCoins(configs, seeds, workers, db) if workers is not None else None
 
+    prepare = batch_row_chunks if low_memory else batch_rows
+    writer = BackgroundWriter(db, prepare=prepare, chunked=low_memory) if pipelined else None
+
+    log = None
+    if log_path is not None:
+        log = ColumnarLog(log_path)
+        log.clear()
+
+    def write(batch):
+        if log is not None:
+            user_rows, columns = batch
+            return log.append(columns, users=[u_id for u_id, in user_rows])
+        if writer is not None:
+            writer.put(batch)
+            return None
+        if low_memory:
+            return db.add_row_chunks(batch_row_chunks(batch))
+        return db.add_rows(**batch_rows(batch))
+
+    # With workers, the coins are simulated by ParallelCoins rather than by simulators of this process
+    simulators = []
+    if workers is None and engine == 'numpy':
+        simulators = [VectorCointSimulator(conf=cfg, database=db, seed=s) for cfg, s in zip(configs, seeds)]
+    elif workers is None:
+        random.seed(seed)
+        simulators = [CointSimulator(conf=cfg, database=db) for cfg in configs]
+
+    all_users = range(0) if write_mode == 'bulk' else []
     flushable_objects = []
-    for t in tqdm(range(max_turn), desc="Simulating "):
-        new_users = [User() for _ in range(new_user_at_turn(t, simulators))]
-        all_users += new_users
-        db.add_objects(new_users)
+    user_rows = []
+
+    start = 0
+    if resume:
+        for simulator in simulators:
+            simulator.set_state(pickle.loads(states[simulator.config['crypto_name']]))
+
+        # Simulators number their turns from 1, turn t of the loop is turn t + 1 of the simulators
+        start = simulators[0].turn_number
+        all_users = simulators[0].user_list
+        db.truncate(state_turn, last_user=all_users.stop - 1,
+                    last_account=max(int(s.account_ids.ids[:s.n_accounts].max(initial=0)) for s in simulators),
+                    balances=[row for s in simulators for row in zip(round_balances(s.balances[:s.n_accounts]),
+                                                                     s.account_ids.ids[:s.n_accounts].tolist())])
+        if start >= max_turn:
+            db.s.close()
+            return
+
+    def step(user_list):
+        if coins is not None:
+            coins.turn(user_list)
+            return
 
         for simulator in simulators:
             if verbose:
                 print(f'>{simulator.config["crypto_name"]}')
 
-            new_objects = simulator.turn(user_list=all_users, verbose=verbose)
-            flushable_objects += new_objects
+            new_objects = simulator.turn(user_list=user_list, verbose=verbose)
+            flushable_objects.extend(new_objects)
+
+    def flush(t, checkpoint=False):
+        # Simulators number their turns from 1, so the flushed transactions are the ones with time < turn_number
+        turn_number = t + 2
 
-        if t % 10 == 0:
-            now = datetime.datetime.now().isoformat(' ')
-            print(f' > flushing {len(flushable_objects)} objects at [{now}]')
-            db.add_objects(flushable_objects)
-            flushable_objects = []
-            now = datetime.datetime.now().isoformat(' ')
-            print(f' > Done at [{now}]')
+        if write_mode == 'bulk':
+            if coins is not None:
+                columns = coins.flush_columns(all_users, checkpoint=checkpoint)
+            else:
+                columns = [simulator.flush_columns(checkpoint=checkpoint) for simulator in simulators]
+            batch = (list(user_rows), columns)
+            user_rows.clear()
+            n_rows = write(batch)
+            if on_flush is not None:
+                on_flush(db, turn_number, batch[1])
+            return n_rows
+
+        for simulator in simulators:
+            flushable_objects.extend(simulator.flush())
+        n_objects = len(flushable_objects)
+        db.add_objects(flushable_objects)
+        flushable_objects.clear()
 
-        if verbose:
-            print('=' * 60)
-            print(f'Iteration # {t}')
-            print(f'Number of Users : {len(all_users)}')
+        # Account ids are only known once committed
+        if checkpoint:
+            n_objects += db.add_rows(checkpoints=[row for s in simulators for row in s.checkpoint_rows()])
+        if on_flush is not None:
+            on_flush(db, turn_number, None)
+        return n_objects
 
-            for s in simulators:
-                print(f'{s.config["crypto_name"]}: #acccounts: {len(s.accounts)}')
-            print('=' * 60)
+    try:
+        for t in tqdm(range(start, max_turn), desc="Simulating "):
+            n_users = new_user_at_turn(t, configs)
+            if write_mode == 'bulk':
+                new_users = db.reserve_ids(User, n_users)
+                user_rows.extend((uid,) for uid in new_users)
+                # Reserved ids are consecutive, so the user list is kept as a range
+                all_users = range(new_users.start - len(all_users), new_users.stop)
+            else:
+                new_users = [User() for _ in range(n_users)]
+                db.add_objects(new_users)
+                all_users += new_users
 
+            step(all_users)
+
+            # The last turn is always flushed, with a checkpoint when they are enabled. A checkpoint is taken at
+            # a flush, so turns with a checkpoint due are flushed too.
+            last = t == max_turn - 1
+            checkpoint = checkpoint_every is not None and (t % checkpoint_every == 0 or last)
+            flushed = t % 10 == 0 or checkpoint or last
+            if flushed and pipelined:
+                flush(t, checkpoint=checkpoint)
+            elif flushed:
+                now = datetime.datetime.now().isoformat(' ')
+                print(f' > flushing at [{now}]')
+                n_flushed = flush(t, checkpoint=checkpoint)
+                now = datetime.datetime.now().isoformat(' ')
+                print(f' > Done flushing {n_flushed} objects at [{now}]')
+
+            if verbose:
+                print('=' * 60)
+                print(f'Iteration # {t}')
+                print(f'Number of Users : {len(all_users)}')
+
+                for s in simulators:
+                    print(f'{s.config["crypto_name"]}: #acccounts: {s.get_update()}')
+                print('=' * 60)
+    except BaseException:
+        if writer is not None:
+            writer.stop()
+        raise
+    finally:
+        if coins is not None:
+            coins.close()
+
+    if writer is not None:
+        writer.close()
     db.s.close()
 
 
+def resume(max_turn, **kwargs):
+    """
+    Goes on with the simulation stored in the database from its latest checkpoint up to max_turn, which also
+    extends a finished run. Same as setup(resume=True) with the numpy engine and the bulk write mode.
+
+    Parameters
+    ----------
+    max_turn: int
+        Number of turns of the whole simulation, the turns before the checkpoint included
+
+    kwargs:
+        Other keyword arguments of setup(), e.g. checkpoint_every to keep saving checkpoints or url
+    """
+    return setup(max_turn=max_turn, engine='numpy', write_mode='bulk', resume=True, **kwargs)
+
+
 if __name__ == '__main__':
     setup(max_turn=1000, n_coins=5, verbose=False)
     print('Done!')
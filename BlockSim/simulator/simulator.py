@@ -1,5 +1,9 @@
+import itertools
 import random
+import pickle
+import numpy as np
 from BlockSim.orm import database as db
+from BlockSim.simulator.indexes import SampleableSet, grow
 
 base_config = {
     'crypto_name': 'Bitcoin',
@@ -8,7 +12,19 @@ base_config = {
 }
 
 
+def round_balances(balances):
+    """
+    Converts NumPy balances to Python floats rounded to 8 decimals with round(), like the balances of CointSimulator.
+    numpy.round() scales by 10 ** 8 and back, which can leave its result one bit away from the closest float to the
+    decimal value (e.g. 12.215585460000002 instead of 12.21558546). Stored balances then match a replay of the
+    transactions rounded the same way.
+    """
+    return [round(balance, 8) for balance in balances.tolist()]
+
+
 class CointSimulator:
+    database_required = True
+
     def __init__(self, conf=None, database=None):
         """
         Initializing a ConfigSimulator class designed to store each crypto type information
@@ -24,7 +40,7 @@ class CointSimulator:
         """
         self.turn_number = 0
 
-        if not isinstance(database, db.Database):
+        if (database is not None or self.database_required) and not isinstance(database, db.Database):
             raise TypeError('Database should be an instance of BlockSim.orm.database.Database()')
 
         if conf is None:
@@ -34,9 +50,73 @@ class CointSimulator:
         self.database = database
         self.accounts = []
 
+        # Positions in the user list of the users without an account of this coin
+        self.eligible_users = SampleableSet()
+        self.n_users = 0
+
+        # Indices of the accounts with a positive balance
+        self.funded = SampleableSet()
+
     def get_update(self):
         return len(self.accounts)
 
+    def pick_owners(self, user_list, n):
+        """
+        Draws owners for n new accounts among the users without an account of this coin, with replacement.
+        The user list is expected to only grow between turns, so the index only needs to learn the new users.
+
+        Parameters
+        ----------
+        user_list: list
+            List of users
+
+        n: int
+            Number of new accounts
+
+        Returns
+        -------
+        owners: list
+            Positions of the owners in user_list
+        """
+        self.eligible_users.update(range(self.n_users, len(user_list)))
+        self.n_users = len(user_list)
+
+        owners = self.eligible_users.choices(n)
+        self.eligible_users.difference_update(owners)
+        return owners
+
+    def checkpoint_turn(self):
+        """
+        Returns the turn of a balance checkpoint taken now. Like Finder's turn_number, it is the first turn whose
+        transactions are not included.
+        """
+        return self.turn_number + 1
+
+    def checkpoint_rows(self):
+        """
+        Snapshot of the funded accounts for the balance_checkpoints table, see BlockSim.orm.database.BalanceCheckpoint.
+        The accounts must have been committed, so they have an id.
+
+        Returns
+        -------
+        rows: list
+            Tuples of (turn, account_id, balance)
+        """
+        turn = self.checkpoint_turn()
+        return [(turn, self.accounts[i].id, self.accounts[i].balance) for i in self.funded]
+
+    def flush(self):
+        """
+        Returns the objects that were deferred until the next database flush. Transactions and accounts of
+        this simulator are handed out directly by self.turn(), so nothing is deferred.
+
+        Returns
+        -------
+        new_db_objects: list
+            A list of new objects that should be added to the database
+        """
+        return []
+
     def commit_transaction(self, src_index, dst_index):
         """
         Commint a transaction from src to dst. The amount is chosen by a random number times balance of the
@@ -73,6 +153,11 @@ class CointSimulator:
             src_account.balance = round(src_account.balance - amount, 8)
             dst_account.balance = round(dst_account.balance + amount, 8)
 
+            if src_account.balance <= 0:
+                self.funded.discard(src_index)
+            if dst_account.balance > 0:
+                self.funded.add(dst_index)
+
             trx = db.Transaction(amount=amount, source=src_account,
                                  destination=dst_account, time=self.turn_number)
             return trx
@@ -104,28 +189,30 @@ class CointSimulator:
 
         n_account = int(self.config['new_accounts'](self.turn_number))
 
-        cname = self.config.get('crypto_name', 'all')
-        u_list = list(filter(lambda u: u.acc_count(cname) < 1, user_list))
-        new_accounts = [db.Account(owner=random.choice(u_list), balance=0.0,
+        owners = self.pick_owners(user_list, n_account)
+        new_accounts = [db.Account(owner=user_list[owner], balance=0.0,
                                    crypto_type=self.config.get('crypto_name', 'Bitcoin'))
-                        for _ in range(n_account)]
+                        for owner in owners]
 
         self.accounts += new_accounts
 
         # Miner gift
-        miner_db = random.choice(self.accounts)
+        miner_index = random.randrange(len(self.accounts))
+        miner_db = self.accounts[miner_index]
 
         miner_gift = self.config.get('miner_gift')(self.turn_number)
         miner_db.balance = miner_db.balance + miner_gift
+        if miner_db.balance > 0:
+            self.funded.add(miner_index)
 
         miner_trx = db.Transaction(amount=miner_gift, source=None,
                                    destination=miner_db, time=self.turn_number)
 
-        non_zero_accounts = [idx for idx, acc in enumerate(self.accounts) if acc.balance > 0]
         n_trx = random.randint(0, len(self.accounts))
 
-        src_index = random.choices(non_zero_accounts, k=int(n_trx))
-        dst_index = random.choices(list(range(len(self.accounts))), k=int(n_trx))
+        # Sources are drawn among the accounts funded before any of this turn's transactions
+        src_index = self.funded.choices(k=int(n_trx))
+        dst_index = [random.randrange(len(self.accounts)) for _ in range(n_trx)]
 
         new_transactions = []
         for i, (s, d) in enumerate(zip(src_index, dst_index)):
@@ -138,3 +225,474 @@ class CointSimulator:
 
         new_db_objects = new_accounts + new_transactions + [miner_trx]
         return new_db_objects
+
+
+class VectorCointSimulator(CointSimulator):
+    database_required = False
+
+    def __init__(self, conf=None, database=None, seed=None):
+        """
+        Array-backed version of CointSimulator. Balances and owners are kept in NumPy arrays and a whole turn of
+        transactions is drawn and applied in vectorized form. Database rows are only created by self.flush().
+
+        Sources spend from their balance at the start of the turn: a source that is drawn several times in the same
+        turn spends from what its earlier transfers left, in drawing order, while credits received during the turn
+        can only be spent from the next turn on.
+
+        Parameters
+        ----------
+        conf: dict
+            Config dictionary. Could be instantiated from BlockSim.simulator.simulator.base_config
+
+        database: BlockSim.orm.database.Database()
+            Database object. Can be None if the simulator is only flushed with self.flush_local().
+
+        seed: int or numpy.random.SeedSequence
+            Seed of the NumPy random generator
+        """
+        super().__init__(conf=conf, database=database)
+        self.rng = np.random.default_rng(seed)
+
+        self.n_accounts = 0
+        self.balances = np.zeros(0, dtype=np.float64)
+        self.owners = np.zeros(0, dtype=np.int64)
+        self.account_ids = AccountIds(database)
+
+        self.user_list = []
+        self.n_flushed = 0
+        self.pending_transactions = []
+        self.touched = []
+
+    def get_update(self):
+        return self.n_accounts
+
+    def pick_owners(self, user_list, n):
+        self.eligible_users.update(np.arange(self.n_users, len(user_list)))
+        self.n_users = len(user_list)
+
+        owners = self.eligible_users.sample(self.rng, n)
+        self.eligible_users.difference_update(owners)
+        return owners
+
+    def add_accounts(self, owners):
+        """
+        Opens a zero balance account for each user index in owners.
+
+        Parameters
+        ----------
+        owners: numpy.ndarray
+            Indices of the owners in the user list
+        """
+        size = self.n_accounts + len(owners)
+        self.balances = grow(self.balances, size)
+        self.owners = grow(self.owners, size)
+
+        self.owners[self.n_accounts:size] = owners
+        self.n_accounts = size
+
+    def commit_transactions(self, src, dst):
+        """
+        Commits a batch of transactions. Amounts follow CointSimulator.commit_transaction(): in 5% of the cases the
+        source is drained, otherwise a random fraction of its balance is sent. Self-transfers and zero amounts are
+        skipped.
+
+        Parameters
+        ----------
+        src: numpy.ndarray
+            Source account indices
+        dst: numpy.ndarray
+            Destination account indices
+
+        Returns
+        -------
+        (src, dst, amount): tuple
+            Arrays describing the committed transactions, in drawing order
+        """
+        keep = src != dst
+        src, dst = src[keep], dst[keep]
+
+        drain = self.rng.random(len(src)) < 0.05
+        fraction = self.rng.random(len(src))
+
+        # Rank of each transaction among the ones sharing its source, in drawing order
+        order = np.argsort(src, kind='stable')
+        sorted_src = src[order]
+        group_start = np.flatnonzero(np.r_[True, sorted_src[1:] != sorted_src[:-1]])
+        group_size = np.diff(np.r_[group_start, len(src)])
+        rank = np.empty(len(src), dtype=np.int64)
+        rank[order] = np.arange(len(src)) - np.repeat(group_start, group_size)
+
+        # Each round holds distinct sources, so it can be applied at once
+        balances = self.balances
+        amount = np.zeros(len(src), dtype=np.float64)
+        for r in range(int(rank.max(initial=-1)) + 1):
+            sel = np.flatnonzero(rank == r)
+            s = src[sel]
+            available = balances[s]
+            a = np.where(drain[sel], available, np.round(fraction[sel] * available, 8))
+            amount[sel] = a
+            balances[s] = np.where(a > 0, np.round(available - a, 8), available)
+
+        keep = amount > 0
+        src, dst, amount = src[keep], dst[keep], amount[keep]
+
+        receivers, inverse = np.unique(dst, return_inverse=True)
+        balances[receivers] = np.round(balances[receivers] + np.bincount(inverse, weights=amount), 8)
+
+        self.funded.difference_update(src[balances[src] <= 0])
+        self.funded.update(receivers[balances[receivers] > 0])
+
+        self.touched += [src, receivers]
+        return src, dst, amount
+
+    def turn(self, user_list=None, verbose=False):
+        """
+        Computes the next turn.
+
+        Parameters
+        ----------
+        user_list: list
+            List of users of type BlockSim.orm.database.User(). The list is expected to only grow between turns.
+
+        verbose: bool
+            Verbose printing details
+
+        Returns
+        -------
+        new_db_objects: list
+            Always empty, new objects are created by self.flush()
+        """
+        self.turn_number += 1
+
+        if user_list is None:
+            update = self.get_update()
+            return update
+
+        self.user_list = user_list
+        n_account = int(self.config['new_accounts'](self.turn_number))
+        self.add_accounts(self.pick_owners(user_list, n_account))
+
+        # Miner gift
+        miner = self.rng.integers(0, self.n_accounts)
+        miner_gift = self.config.get('miner_gift')(self.turn_number)
+        self.balances[miner] = self.balances[miner] + miner_gift
+        if self.balances[miner] > 0:
+            self.funded.add(miner)
+
+        n_trx = self.rng.integers(0, self.n_accounts + 1)
+
+        src_index = self.funded.sample(self.rng, n_trx)
+        dst_index = self.rng.integers(0, self.n_accounts, n_trx)
+
+        src, dst, amount = self.commit_transactions(src_index, dst_index)
+        if verbose:
+            print(f'({self.config["crypto_name"]}) {len(src)} TRX out of {n_trx}')
+
+        self.pending_transactions.append((self.turn_number, src, dst, amount))
+        self.pending_transactions.append((self.turn_number, np.array([-1]), np.array([miner]),
+                                          np.array([miner_gift], dtype=np.float64)))
+        self.touched.append(np.array([miner]))
+        return []
+
+    def drain(self):
+        """
+        Collects and clears what happened since the last flush.
+
+        Returns
+        -------
+        (updated, time, src, dst, amount): tuple
+            Indices of already flushed accounts whose balance changed, followed by the pending transactions as
+            arrays, src is -1 for miner gifts
+        """
+        updated = np.zeros(0, dtype=np.int64)
+        if self.touched:
+            updated = np.unique(np.concatenate(self.touched))
+            updated = updated[updated < self.n_flushed]
+
+        empty = (0, np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64))
+        pending = self.pending_transactions + [empty]
+
+        time = np.concatenate([np.full(len(src), t, dtype=np.int64) for t, src, _, _ in pending])
+        src = np.concatenate([src for _, src, _, _ in pending])
+        dst = np.concatenate([dst for _, _, dst, _ in pending])
+        amount = np.concatenate([amount for _, _, _, amount in pending])
+
+        self.pending_transactions = []
+        self.touched = []
+        return updated, time, src, dst, amount
+
+    def flush(self):
+        """
+        Creates the database objects for everything that happened since the last flush: new accounts, balance
+        updates of already flushed accounts and transactions.
+
+        Returns
+        -------
+        new_db_objects: list
+            A list of new objects that should be added to the database
+        """
+        if not self.pending_transactions:
+            return []
+
+        self.account_ids.assign(self.n_accounts)
+        crypto_type = self.config.get('crypto_name', 'Bitcoin')
+        balances = self.balances.tolist()
+        new = range(self.n_flushed, self.n_accounts)
+
+        new_accounts = [db.Account(id=a_id, owner=self.user_list[owner], balance=round(balances[i], 8),
+                                   crypto_type=crypto_type)
+                        for i, a_id, owner in zip(new, self.account_ids.ids[new].tolist(), self.owners[new].tolist())]
+
+        updated, time, src, dst, amount = self.drain()
+        for i in updated.tolist():
+            self.accounts[i].balance = round(balances[i], 8)
+
+        self.accounts += new_accounts
+        self.n_flushed = self.n_accounts
+
+        new_transactions = [db.Transaction(amount=a, source=self.accounts[s] if s >= 0 else None,
+                                           destination=self.accounts[d], time=t)
+                            for t, s, d, a in zip(time.tolist(), src.tolist(), dst.tolist(), amount.tolist())]
+
+        return new_accounts + new_transactions
+
+    def checkpoint_rows(self):
+        """
+        Snapshot of the funded accounts for the balance_checkpoints table, see BlockSim.orm.database.BalanceCheckpoint.
+        All accounts must have been flushed.
+
+        Returns
+        -------
+        rows: list
+            Tuples of (turn, account_id, balance)
+        """
+        funded = self.funded.members[:len(self.funded)]
+        return list(zip(itertools.repeat(self.checkpoint_turn()), self.account_ids.ids[funded].tolist(),
+                        round_balances(self.balances[funded])))
+
+    def flush_local(self, checkpoint=False):
+        """
+        Collects everything that happened since the last flush as NumPy columns indexed by local account indices,
+        without touching the database.
+
+        Parameters
+        ----------
+        checkpoint: bool
+            Also take a snapshot of the funded accounts for the balance_checkpoints table
+
+        Returns
+        -------
+        local: dict
+            Input of AccountIds.to_columns()
+        """
+        if not self.pending_transactions and not checkpoint:
+            return dict()
+
+        new = slice(self.n_flushed, self.n_accounts)
+        local = dict(crypto_type=self.config.get('crypto_name', 'Bitcoin'), first=self.n_flushed,
+                     owners=self.owners[new].copy(), new_balances=self.balances[new].copy())
+
+        updated, local['time'], local['src'], local['dst'], local['amount'] = self.drain()
+        local['updated'], local['updated_balances'] = updated, self.balances[updated]
+
+        if checkpoint:
+            funded = self.funded.members[:len(self.funded)].copy()
+            local['checkpoint'] = (self.checkpoint_turn(), funded, self.balances[funded])
+
+        self.n_flushed = self.n_accounts
+        return local
+
+    def flush_columns(self, checkpoint=False):
+        """
+        Same as self.flush(), but keeps the new rows as NumPy columns with primary keys assigned up front.
+        Users in the user list are expected to be user ids. The columns are copies, so they can be converted with
+        columns_to_rows() while the simulation goes on.
+
+        Parameters
+        ----------
+        checkpoint: bool
+            Also take a snapshot of the funded accounts for the balance_checkpoints table, and of the simulator
+            for the simulator_states table, see self.get_state()
+
+        Returns
+        -------
+        columns: dict
+            See AccountIds.to_columns(). With a checkpoint, also maps 'state' to (turn, pickled state).
+        """
+        columns = self.account_ids.to_columns(self.flush_local(checkpoint=checkpoint), self.user_list)
+        if checkpoint:
+            columns['state'] = (self.checkpoint_turn(), pickle.dumps(self.get_state(), pickle.HIGHEST_PROTOCOL))
+        return columns
+
+    def get_state(self):
+        """
+        Everything needed to go on with the simulation, see self.set_state(). It is only complete right after a
+        flush, when no transaction is pending.
+
+        Returns
+        -------
+        state: dict
+            Turn number, random generator state, account ids, balances and owners, the funded accounts and the
+            users without an account of this coin, in sampling order, and the user list
+        """
+        if self.pending_transactions or self.n_flushed < self.n_accounts:
+            raise ValueError('The simulator state is only complete right after a flush')
+
+        n = self.n_accounts
+        return dict(turn_number=self.turn_number, rng=self.rng.bit_generator.state,
+                    ids=self.account_ids.ids[:n].copy(), balances=self.balances[:n].copy(),
+                    owners=self.owners[:n].copy(), funded=self.funded.members[:len(self.funded)].copy(),
+                    eligible_users=self.eligible_users.members[:len(self.eligible_users)].copy(),
+                    n_users=self.n_users, user_list=self.user_list if isinstance(self.user_list, range)
+                    else list(self.user_list))
+
+    def set_state(self, state):
+        """
+        Restores a state returned by self.get_state(). The simulation then goes on exactly as it would have from
+        the flush where the state was taken.
+
+        Parameters
+        ----------
+        state: dict
+            Output of self.get_state()
+        """
+        self.turn_number = state['turn_number']
+        self.rng.bit_generator.state = state['rng']
+
+        self.n_accounts = self.n_flushed = len(state['balances'])
+        self.balances = state['balances'].copy()
+        self.owners = state['owners'].copy()
+        self.account_ids.ids = state['ids'].copy()
+        self.account_ids.n = len(state['ids'])
+
+        self.funded = SampleableSet.from_members(state['funded'])
+        self.eligible_users = SampleableSet.from_members(state['eligible_users'])
+        self.n_users = state['n_users']
+        self.user_list = state['user_list']
+
+        self.pending_transactions = []
+        self.touched = []
+
+
+class AccountIds:
+    def __init__(self, database):
+        """
+        Maps the local account indices of one coin to the primary keys reserved for them in the database.
+
+        Parameters
+        ----------
+        database: BlockSim.orm.database.Database()
+            Database object
+        """
+        self.database = database
+        self.n = 0
+        self.ids = np.zeros(0, dtype=np.int64)
+
+    def assign(self, n_accounts):
+        """
+        Reserves primary keys for the local accounts up to n_accounts.
+        """
+        ids = self.database.reserve_ids(db.Account, n_accounts - self.n)
+        self.ids = grow(self.ids, n_accounts)
+        self.ids[self.n:n_accounts] = np.arange(ids.start, ids.stop)
+        self.n = n_accounts
+
+    def to_columns(self, local, user_list):
+        """
+        Converts the output of VectorCointSimulator.flush_local() to database ids, reserving the missing ones.
+
+        Parameters
+        ----------
+        local: dict
+            Output of VectorCointSimulator.flush_local()
+
+        user_list: list
+            User ids, indexed by the owners of the new accounts
+
+        Returns
+        -------
+        columns: dict
+            Maps 'accounts' to (id, owner_id, balance), 'balances' to (balance, id) and 'transactions' to
+            (id, amount, time, src, dst) with src = -1 for miner gifts. Also holds the 'crypto_type' and, if a
+            snapshot was taken, maps 'checkpoint' to (turn, account ids, balances).
+        """
+        if not local:
+            return dict()
+
+        self.assign(local['first'] + len(local['owners']))
+        ids = self.ids
+        new = slice(local['first'], self.n)
+
+        owner_ids = np.array([user_list[owner] for owner in local['owners'].tolist()], dtype=np.int64)
+        src, dst = local['src'], local['dst']
+        trx_ids = self.database.reserve_ids(db.Transaction, len(src))
+
+        columns = dict(crypto_type=local['crypto_type'],
+                       accounts=(ids[new].copy(), owner_ids, local['new_balances']),
+                       balances=(local['updated_balances'], ids[local['updated']]),
+                       transactions=(np.arange(trx_ids.start, trx_ids.stop), local['amount'], local['time'],
+                                     np.where(src >= 0, ids[src], -1), ids[dst]))
+
+        if 'checkpoint' in local:
+            turn, funded, balances = local['checkpoint']
+            columns['checkpoint'] = (turn, ids[funded], balances)
+
+        return columns
+
+
+def columns_to_rows(columns):
+    """
+    Converts the output of VectorCointSimulator.flush_columns() to keyword arguments of
+    BlockSim.orm.database.Database.add_rows()
+    """
+    if not columns:
+        return dict()
+
+    a_ids, owner_ids, balances = columns['accounts']
+    accounts = list(zip(a_ids.tolist(), owner_ids.tolist(), itertools.repeat(columns['crypto_type']),
+                        round_balances(balances)))
+
+    u_balances, u_ids = columns['balances']
+    balances = list(zip(round_balances(u_balances), u_ids.tolist()))
+
+    t_ids, amount, time, src, dst = columns['transactions']
+    src_ids = src.tolist()
+    for i in np.flatnonzero(src < 0).tolist():
+        src_ids[i] = None
+    transactions = list(zip(t_ids.tolist(), amount.tolist(), time.tolist(), src_ids, dst.tolist()))
+
+    rows = dict(accounts=accounts, transactions=transactions, balances=balances)
+    if 'checkpoint' in columns:
+        turn, c_ids, c_balances = columns['checkpoint']
+        rows['checkpoints'] = list(zip(itertools.repeat(turn), c_ids.tolist(), round_balances(c_balances)))
+
+    if 'state' in columns:
+        turn, state = columns['state']
+        rows['states'] = [(turn, columns['crypto_type'], state)]
+
+    return rows
+
+
+def split_columns(columns, chunk_size):
+    """
+    Splits an output of VectorCointSimulator.flush_columns() into parts of at most chunk_size transactions, so they
+    can be converted with columns_to_rows() one at a time. New accounts, balance updates, the checkpoint and the
+    state go with the first part.
+
+    Yields
+    ------
+    columns: dict
+        Same layout as the input
+    """
+    if not columns:
+        return
+
+    transactions = columns['transactions']
+    for start in range(0, max(len(transactions[0]), 1), chunk_size):
+        part = dict(columns, transactions=tuple(c[start:start + chunk_size] for c in transactions))
+        if start > 0:
+            part['accounts'] = tuple(c[:0] for c in columns['accounts'])
+            part['balances'] = tuple(c[:0] for c in columns['balances'])
+            part.pop('checkpoint', None)
+            part.pop('state', None)
+        yield part
@@ -10,6 +10,7 @@ with open('README.rst') as readme_file:
 requirements = [
     'sqlalchemy',
     'tqdm',
+    'numpy',
 ]
 
 setup_requirements = []
@@ -0,0 +1,14 @@
+from BlockSim.simulator.run import setup
+import pytest
+
+coins = ['Bitcoin', 'Ethereum', 'Doge']
+
+
+@pytest.fixture(scope='session')
+def simulation(tmp_path_factory):
+    """
+    Url of a small seeded simulation with balance checkpoints and simulator states, shared by the tests
+    """
+    url = f'sqlite:///{tmp_path_factory.mktemp("simulation") / "database.db"}'
+    setup(max_turn=41, n_coins=len(coins), seed=1, engine='numpy', write_mode='bulk', checkpoint_every=20, url=url)
+    return url
@@ -0,0 +1,91 @@
+from BlockSim.finder.cache import ResultCache
+from BlockSim.finder.finder import Finder
+from BlockSim.orm.database import Database
+from tests.conftest import coins
+import pytest
+
+ratios = dict(zip(coins, [0.5, 0.3, 0.2]))
+
+
+def identifiers(answers):
+    return [{c: [acc.identifier for acc in accounts] for c, accounts in answer.d.items()} for answer in answers]
+
+
+def test_least_recently_used_is_evicted():
+    cache = ResultCache(max_size=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+
+    # 'b' is now the least recently used
+    cache.put('c', 3)
+    assert len(cache) == 2
+    with pytest.raises(KeyError):
+        cache.get('b')
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_queries_are_counted(simulation):
+    cache = ResultCache(precision=4)
+    finder = Finder(40, database=Database(url=simulation), synthetic=False, cache=cache)
+    finder.progress = False
+
+    first, _ = finder.find_top(ratios, top=3)
+    assert (cache.hits, cache.misses) == (0, 1)
+
+    # Ratios equal up to the precision, and arguments left out of the key, share the result
+    nearly = {c: r + 1e-6 for c, r in ratios.items()}
+    assert finder.find_top(nearly, top=3, chunk_size=7)[0] is first
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    finder.find_top(ratios, top=4)
+    finder.find_paper(ratios)
+    assert (cache.hits, cache.misses) == (1, 3)
+    assert len(cache) == 3
+
+
+def test_update_and_poll_invalidate(simulation):
+    cache = ResultCache()
+    finder = Finder(20, database=Database(url=simulation), synthetic=False, cache=cache)
+    finder.progress = False
+    finder.find_top(ratios, top=3)
+
+    finder.poll(41)
+    answers, _ = finder.find_top(ratios, top=3)
+    assert cache.misses == 2
+    expected, _ = Finder(41, database=Database(url=simulation), synthetic=False).find_top(ratios, top=3)
+    assert identifiers(answers) == identifiers(expected)
+
+    # Change the balance of an account of the best answer
+    coin, [account] = next((c, accounts) for c, accounts in answers[0].d.items() if len(accounts) == 1)
+    finder.update(42, {coin: {account.identifier: account.balance * 3}})
+    answers, _ = finder.find_top(ratios, top=3)
+    assert cache.misses == 3
+
+    uncached = Finder(41, database=Database(url=simulation), synthetic=False)
+    uncached.update(42, {coin: {account.identifier: account.balance * 3}})
+    expected, _ = uncached.find_top(ratios, top=3)
+    assert identifiers(answers) == identifiers(expected)
+
+
+def test_reload_needs_same_balances(simulation, tmp_path):
+    path = str(tmp_path / 'cache.pkl')
+    cache = ResultCache(path=path)
+    finder = Finder(40, database=Database(url=simulation), synthetic=False, cache=cache)
+    finder.progress = False
+    answers, _ = finder.find_top(ratios, top=3)
+    cache.save()
+
+    reloaded = ResultCache(path=path)
+    same = Finder(40, database=Database(url=simulation), synthetic=False, cache=reloaded)
+    assert len(reloaded) == 1
+    assert identifiers(same.find_top(ratios, top=3)[0]) == identifiers(answers)
+    assert (reloaded.hits, reloaded.misses) == (1, 0)
+
+    # Balances of another turn have another fingerprint
+    other = ResultCache(path=path)
+    Finder(20, database=Database(url=simulation), synthetic=False, cache=other)
+    assert other.fingerprint != cache.fingerprint
+    assert len(other) == 0
@@ -0,0 +1,78 @@
+from BlockSim.orm.columnar import ColumnarLog
+from BlockSim.orm.database import Database
+from BlockSim.simulator.run import setup
+import sqlalchemy as sa
+import numpy as np
+import threading
+import pytest
+
+
+def rows(url):
+    database = Database(url=url)
+    with database.engine.connect() as connection:
+        tables = {name: connection.execute(sa.text(f'SELECT * FROM {name} ORDER BY id')).all()
+                  for name in ('users', 'accounts', 'transactions')}
+    database.engine.dispose()
+    return tables
+
+
+def test_export_matches_database(tmp_path):
+    direct, exported = f'sqlite:///{tmp_path / "direct.db"}', f'sqlite:///{tmp_path / "exported.db"}'
+    kwargs = dict(max_turn=41, n_coins=3, seed=2, engine='numpy', write_mode='bulk')
+
+    setup(url=direct, **kwargs)
+    setup(url=f'sqlite:///{tmp_path / "ids.db"}', log_path=str(tmp_path / 'log'), **kwargs)
+    log = ColumnarLog(str(tmp_path / 'log'))
+    assert log.n_turns == 42
+    log.export(Database(url=exported))
+
+    assert rows(exported) == rows(direct)
+
+
+def test_log_rejects_checkpoints(tmp_path):
+    with pytest.raises(ValueError, match='checkpoint_every'):
+        setup(max_turn=11, n_coins=2, seed=0, engine='numpy', write_mode='bulk', checkpoint_every=10,
+              url=f'sqlite:///{tmp_path / "ids.db"}', log_path=str(tmp_path / 'log'))
+
+
+def test_reload_while_appending(tmp_path):
+    writer, reader = ColumnarLog(str(tmp_path / 'log')), ColumnarLog(str(tmp_path / 'log'))
+    errors, done = [], threading.Event()
+
+    def follow():
+        while not done.is_set():
+            try:
+                reader.reload()
+            except Exception as e:
+                errors.append(e)
+
+    thread = threading.Thread(target=follow)
+    thread.start()
+    for t in range(300):
+        columns = dict(crypto_type='Bitcoin', accounts=(np.array([t + 1]), np.array([t + 1]), np.array([6.25])),
+                       transactions=(np.array([t + 1]), np.array([6.25]), np.array([t + 1]), np.array([-1]),
+                                     np.array([t + 1])))
+        writer.append([columns], users=[t + 1])
+    done.set()
+    thread.join()
+
+    assert errors == []
+    reader.reload()
+    assert len(reader) == 300 and reader.n_turns == 301
+
+
+def test_log_keeps_database(tmp_path):
+    kwargs = dict(max_turn=11, n_coins=2, seed=0, engine='numpy', write_mode='bulk', log_path=str(tmp_path / 'log'))
+    with pytest.raises(ValueError, match='url'):
+        setup(**kwargs)
+
+    url = f'sqlite:///{tmp_path / "database.db"}'
+    setup(max_turn=11, n_coins=2, seed=0, engine='numpy', write_mode='bulk', url=url)
+    before = rows(url)
+
+    setup(url=url, **kwargs)
+    assert rows(url) == before
+
+    # Ids go on after the rows of the database
+    first = min(int(acc['id'].min()) for acc in ColumnarLog(str(tmp_path / 'log')).accounts())
+    assert first == len(before['accounts']) + 1
@@ -0,0 +1,25 @@
+from BlockSim.orm.database import Account, Base, Transaction, User, execute_rows
+import sqlalchemy as sa
+import pytest
+
+
+@pytest.mark.parametrize('paramstyle', ['qmark', 'numeric', 'named'])
+def test_execute_rows(tmp_path, paramstyle):
+    # sqlite3 takes every one of these styles, named parameters stand for drivers like psycopg2
+    engine = sa.create_engine(f'sqlite:///{tmp_path / "database.db"}', paramstyle=paramstyle)
+    Base.metadata.create_all(engine)
+
+    with engine.begin() as connection:
+        execute_rows(connection, 'users', [(1,), (2,)])
+        execute_rows(connection, 'accounts', [(1, 1, 'Bitcoin', 0.0), (2, 2, 'Bitcoin', 0.0)])
+        execute_rows(connection, 'transactions', [(1, 6.25, 1, None, 1), (2, 1.5, 2, 1, 2)])
+        execute_rows(connection, 'balances', [(4.75, 1), (1.5, 2)])
+
+    with engine.connect() as connection:
+        assert connection.execute(sa.select(User.id)).all() == [(1,), (2,)]
+        assert connection.execute(sa.select(Account.id, Account.owner_id, Account.balance).order_by(Account.id)) \
+            .all() == [(1, 1, 4.75), (2, 2, 1.5)]
+        assert connection.execute(sa.select(Transaction.id, Transaction.src, Transaction.dst)
+                                  .order_by(Transaction.id)).all() == [(1, None, 1), (2, 1, 2)]
+
+    engine.dispose()
@@ -0,0 +1,249 @@
+from BlockSim.finder.classes import FinderAccount, FinderAnswer, FinderAnswerPaper
+from BlockSim.finder.finder import Finder, aggregate_balances, scan_roots
+from BlockSim.finder.history import BalanceHistory
+from BlockSim.orm.columnar import ColumnarLog
+from BlockSim.orm.database import BalanceCheckpoint, Database
+from BlockSim.simulator.run import setup
+from tests.conftest import coins
+from collections import OrderedDict
+import sqlalchemy as sa
+import numpy as np
+import itertools
+import pytest
+
+
+def test_checkpoints_match_replay(simulation):
+    database = Database(url=simulation)
+    cp = BalanceCheckpoint.__table__
+
+    turns = database.checkpoint_turns()
+    assert len(turns) == 3
+
+    for turn in turns:
+        with database.engine.connect() as connection:
+            rows = connection.execute(sa.select(cp.c.account_id, cp.c.balance).where(cp.c.turn == turn)).all()
+
+        replay = aggregate_balances(database, turn, coins)
+        funded = {acc_id: b for balances in replay.values() for acc_id, b in balances.items() if b > 0}
+        assert dict(rows) == funded
+
+    database.engine.dispose()
+
+
+def ranking(finder, ratios, **kwargs):
+    """
+    Every answer of Finder.find_top(), best first, scored root by root without pruning
+    """
+    indexes = OrderedDict((c, finder.index(c)) for _, c in sorted((len(finder.balances[c]), c) for c in ratios))
+    n = len(next(iter(indexes.values())))
+    best, _ = scan_roots(indexes, ratios, np.arange(n), np.full(n, np.inf), n, chunk_size=1, **kwargs)
+    return [answer for _, _, answer in best]
+
+
+def identifiers(answer):
+    return {c: [acc.identifier for acc in accounts] for c, accounts in answer.d.items()}
+
+
+@pytest.mark.parametrize('kwargs', [{}, dict(eps=0.05), dict(k=3)])
+def test_find_top_tie_order(simulation, kwargs):
+    finder = Finder(40, database=Database(url=simulation), synthetic=False)
+    finder.progress = False
+
+    # Few distinct balances, so that many answers tie
+    rng = np.random.default_rng(0)
+    values = np.round(rng.uniform(0.01, 20, 12), 2)
+    finder.balances = {c: {i * 100 + j: float(rng.choice(values)) for j in range(60)} for i, c in enumerate(coins)}
+    finder.invalidate()
+
+    ratios = dict(zip(coins, [0.5, 0.3, 0.2]))
+    expected = ranking(finder, ratios, **kwargs)
+    assert any(a.key == b.key for a, b in zip(expected, expected[1:]))
+
+    for top, chunk_size in [(1, 10000), (5, 10000), (5, 7)]:
+        answers, _ = finder.find_top(ratios, top=top, chunk_size=chunk_size, **kwargs)
+        assert [identifiers(a) for a in answers] == [identifiers(a) for a in expected[:top]]
+        assert [a.key for a in answers] == [FinderAnswer(a.d).key for a in answers]
+
+
+def test_find_top_exact_ties(simulation):
+    finder = Finder(40, database=Database(url=simulation), synthetic=False)
+    finder.progress = False
+
+    # The second root matches the same scores as the first one, in reverse order: the statistics module scores them
+    # equally, while sums in match order differ in the last bit
+    matches = [9.55, 9.79, 9.91, 9.96] + [40 - 2 * b for b in [9.55, 9.79, 9.91, 9.96]]
+    finder.balances = {'Bitcoin': {1: 10.0, 2: 20.0}, 'Ethereum': {i + 3: b for i, b in enumerate(matches)}}
+    finder.invalidate()
+
+    answers, _ = finder.find_top({'Bitcoin': 0.5, 'Ethereum': 0.5}, top=2, eps=0.05)
+    assert [answer.d['Bitcoin'][0].identifier for answer in answers] == [1, 2]
+    assert answers[0].key == answers[1].key
+    assert finder.find({'Bitcoin': 0.5, 'Ethereum': 0.5}, eps=0.05).d['Bitcoin'][0].identifier == 1
+
+
+def exhaustive_paper(finder, ratios, st=-1, eps=None, k=None):
+    """
+    Answer of Finder.find_paper() scoring every combination of candidates with itertools.product(), in root order
+    """
+    keys = [c for _, c in sorted((len(finder.balances[c]), c) for c in ratios)]
+    roots = finder.index(keys[0])
+
+    best_score, best_answer = st, None
+    for root_id, root_balance in zip(roots.ids.tolist(), roots.balances.tolist()):
+        choices = [[(root_balance, root_id)]]
+        for c in keys[1:]:
+            index = finder.index(c)
+            (start,), (stop,) = index.lookup(np.array([root_balance * ratios[c] / ratios[keys[0]]]), eps=eps, k=k)
+            choices.append(list(zip(index.balances[start:stop].tolist(), index.ids[start:stop].tolist())))
+
+        for chosen in itertools.product(*choices):
+            answer = FinderAnswerPaper({c: FinderAccount(b, i) for c, (b, i) in zip(keys, chosen)}, ratios)
+            if answer.get_score() > best_score:
+                best_score, best_answer = answer.get_score(), answer
+    return best_answer
+
+
+@pytest.mark.parametrize('kwargs', [{}, dict(eps=0.05), dict(k=3), dict(st=2.9)])
+def test_find_paper_matches_exhaustive_search(simulation, kwargs):
+    finder = Finder(40, database=Database(url=simulation), synthetic=False)
+    finder.progress = False
+
+    # Few distinct balances, so that roots have many candidates and answers tie
+    rng = np.random.default_rng(1)
+    values = np.round(rng.uniform(0.01, 20, 15), 2)
+    finder.balances = {c: {i * 100 + j: float(rng.choice(values)) for j in range(n)}
+                       for i, (c, n) in enumerate(zip(coins, [50, 60, 40]))}
+    finder.invalidate()
+
+    for ratios in [dict(zip(coins, [0.5, 0.3, 0.2])), dict(zip(coins[:2], [0.1, 0.9]))]:
+        expected = exhaustive_paper(finder, ratios, **kwargs)
+        for chunk_size in [10000, 7]:
+            answer = finder.find_paper(ratios, beam=None, chunk_size=chunk_size, **kwargs)
+            if expected is None:
+                assert answer is None
+                continue
+            assert {c: (a.identifier, a.balance) for c, a in answer.d.items()} == \
+                {c: (a.identifier, a.balance) for c, a in expected.d.items()}
+            assert answer.get_score() == expected.get_score()
+
+
+@pytest.mark.parametrize('turn', [20, 31, 42])
+def test_loaders_agree(simulation, tmp_path, turn):
+    database = Database(url=simulation)
+    expected = Finder(turn, database=database, synthetic=False, use_checkpoints=False).balances
+    assert sum(len(balances) for balances in expected.values()) > 0
+
+    history = BalanceHistory.build(database, interval=8)
+    log_path = str(tmp_path / 'log')
+    setup(max_turn=41, n_coins=len(coins), seed=1, engine='numpy', write_mode='bulk',
+          url=f'sqlite:///{tmp_path / "ids.db"}', log_path=log_path)
+
+    sources = {
+        'stream': dict(database=database, loader='stream', use_checkpoints=False),
+        'checkpoint': dict(database=database),
+        'checkpoint-stream': dict(database=database, loader='stream'),
+        'history': dict(database=database, history=history),
+        'log': dict(log=ColumnarLog(log_path)),
+    }
+    for name, kwargs in sources.items():
+        assert Finder(turn, synthetic=False, **kwargs).balances == expected, name
+
+    database.engine.dispose()
+
+
+@pytest.mark.parametrize('kwargs', [{}, dict(eps=0.05), dict(k=3)])
+def test_find_top_workers(simulation, kwargs):
+    finder = Finder(40, database=Database(url=simulation), synthetic=False)
+    finder.progress = False
+
+    for ratios in [dict(zip(coins, [0.5, 0.3, 0.2])), dict(zip(coins[:2], [0.1, 0.9]))]:
+        serial, _ = finder.find_top(ratios, top=5, chunk_size=50, **kwargs)
+        parallel, _ = finder.find_top(ratios, top=5, chunk_size=50, workers=3, **kwargs)
+        assert [identifiers(a) for a in parallel] == [identifiers(a) for a in serial]
+        assert [a.key for a in parallel] == [a.key for a in serial]
+
+
+def test_indexes_of_other_balances_are_not_loaded(simulation, tmp_path):
+    path = str(tmp_path / 'indexes.npz')
+    finder = Finder(40, database=Database(url=simulation), synthetic=False)
+    finder.save_indexes(path)
+
+    loaded = Finder(40, database=Database(url=simulation), synthetic=False, index_path=path)
+    assert sorted(loaded.indexes) == sorted(finder.coins)
+    for coin in finder.coins:
+        assert loaded.index(coin).ids.tolist() == finder.index(coin).ids.tolist()
+
+    # Same turn and number of accounts, one balance differs
+    changed = Finder(40, database=Database(url=simulation), synthetic=False)
+    account = next(iter(changed.balances[coins[0]]))
+    changed.balances[coins[0]][account] += 1.0
+    changed.invalidate()
+    assert changed.load_indexes(path) == []
+    assert changed.indexes == {}
+
+
+@pytest.mark.parametrize('kwargs, poll', [
+    (dict(write_mode='bulk'), False),
+    (dict(write_mode='bulk'), True),
+    (dict(write_mode='bulk', pipelined=True), False),
+    (dict(write_mode='orm'), False),
+    (dict(write_mode='bulk', workers=2), False),
+])
+def test_follow_matches_fresh_finder(tmp_path, kwargs, poll):
+    url = f'sqlite:///{tmp_path / "database.db"}'
+    finder = Finder(0, coins=coins, database=Database(url=url))
+    finder.progress = False
+    for coin in coins:
+        finder.index(coin)
+
+    def on_flush(db, turn_number, columns):
+        if poll:
+            finder.poll(turn_number)
+        else:
+            finder.follow(turn_number, columns)
+
+    setup(max_turn=31, n_coins=len(coins), seed=0, engine='numpy', on_flush=on_flush, url=url, **kwargs)
+    assert finder.turn_number == 32
+
+    fresh = Finder(32, coins=coins, database=Database(url=url), use_checkpoints=False)
+    assert finder.balances == fresh.balances
+    assert dict(finder.users.items()) == dict(fresh.users.items())
+    for coin in coins:
+        assert finder.index(coin).ids.tolist() == fresh.index(coin).ids.tolist()
+        assert finder.index(coin).balances.tolist() == fresh.index(coin).balances.tolist()
+    finder.db.engine.dispose()
+
+
+def brute_force_nn(users, ratios):
+    """
+    Every combination of one account per coin of the same owner, as (distance, account ids), closest first
+    """
+    keys = sorted(ratios.keys())
+    shares = np.array([ratios[c] for c in keys])
+    target = np.log(shares[1:]) - np.log(shares[0])
+
+    points = []
+    for owner, accounts in users.items():
+        per_coin = [[(b, a) for c, b, a in accounts if c == coin] for coin in keys]
+        for chosen in itertools.product(*per_coin):
+            balances = np.array([b for b, _ in chosen])
+            distance = float(np.linalg.norm(np.log(balances[1:]) - np.log(balances[0]) - target))
+            points.append((distance, tuple(a for _, a in chosen)))
+    return sorted(points)
+
+
+@pytest.mark.parametrize('cell', [None, 0.05, 5.0])
+def test_find_nn_matches_brute_force(simulation, cell):
+    finder = Finder(40, database=Database(url=simulation))
+    finder.progress = False
+
+    for ratios in [dict(zip(coins, [0.5, 0.3, 0.2])), dict(zip(coins[:2], [0.1, 0.9])),
+                   dict(zip(coins[1:], [0.999, 0.001]))]:
+        expected = brute_force_nn(finder.users, ratios)
+        assert len(expected) > 10
+
+        for k in [1, 10]:
+            answers = finder.find_nn(ratios, k=k, cell=cell)
+            assert [d for d, _ in answers] == pytest.approx([d for d, _ in expected[:k]])
+            assert [tuple(answer.d[c].identifier for c in sorted(ratios)) for _, answer in answers] == \
+                [ids for _, ids in expected[:k]]
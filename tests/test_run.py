@@ -0,0 +1,132 @@
+from BlockSim.orm.database import Account, BalanceCheckpoint, Database, SimulatorState, Transaction, User
+from BlockSim.simulator.run import resume, setup
+import sqlalchemy as sa
+import numpy as np
+import multiprocessing
+import pickle
+import pytest
+
+
+def count(url, table):
+    database = Database(url=url)
+    with database.engine.connect() as connection:
+        n_rows = connection.execute(sa.select(sa.func.count()).select_from(table.__table__)).scalar()
+    database.engine.dispose()
+    return n_rows
+
+
+@pytest.mark.parametrize('kwargs', [
+    dict(engine='numpy', write_mode='bulk'),
+    dict(engine='numpy', write_mode='orm'),
+    dict(engine='orm', write_mode='orm'),
+])
+def test_last_turn_checkpoint_is_written_once(tmp_path, kwargs):
+    # Turn 10 of the loop is both a flush turn and the last one, its checkpoint used to be written twice. Simulators
+    # number their turns from 1, so checkpoints are the ones of turns 2 and 12.
+    url = f'sqlite:///{tmp_path / "database.db"}'
+    setup(max_turn=11, n_coins=2, seed=0, checkpoint_every=10, url=url, **kwargs)
+
+    database = Database(url=url)
+    assert database.checkpoint_turns() == [2, 12]
+    database.engine.dispose()
+
+    if kwargs['write_mode'] == 'bulk':
+        assert count(url, SimulatorState) == 4
+    assert count(url, BalanceCheckpoint) > 0
+
+
+def test_fresh_run_clears_database(tmp_path):
+    url = f'sqlite:///{tmp_path / "database.db"}'
+    tables = (User, Account, Transaction, BalanceCheckpoint, SimulatorState)
+
+    setup(max_turn=11, n_coins=2, seed=0, engine='numpy', write_mode='bulk', checkpoint_every=10, url=url)
+    first = [count(url, table) for table in tables]
+    setup(max_turn=11, n_coins=2, seed=0, engine='numpy', write_mode='bulk', checkpoint_every=10, url=url)
+    assert [count(url, table) for table in tables] == first
+
+
+class Crash(Exception):
+    pass
+
+
+def crash_after(turn):
+    def on_flush(db, turn_number, columns):
+        if turn_number > turn:
+            raise Crash(turn_number)
+    return on_flush
+
+
+def decode(state):
+    # Pickles of equal states may differ, e.g. in how many references they share
+    return {name: value.tolist() if isinstance(value, np.ndarray) else value
+            for name, value in pickle.loads(state).items()}
+
+
+def dump(url):
+    database = Database(url=url)
+    with database.engine.connect() as connection:
+        tables = {table.__tablename__: connection.execute(sa.select(table.__table__).order_by(*table.__table__.c))
+                  .all() for table in (User, Account, Transaction, BalanceCheckpoint)}
+        tables['simulator_states'] = [(turn, coin, decode(state)) for turn, coin, state in connection.execute(
+            sa.select(SimulatorState.__table__).order_by(SimulatorState.turn, SimulatorState.crypto_type))]
+    database.engine.dispose()
+    return tables
+
+
+@pytest.mark.parametrize('workers', [None, 2])
+def test_resumed_run_matches_uninterrupted_run(tmp_path, workers):
+    full, crashed = f'sqlite:///{tmp_path / "full.db"}', f'sqlite:///{tmp_path / "crashed.db"}'
+    kwargs = dict(n_coins=2, seed=0, engine='numpy', write_mode='bulk', checkpoint_every=20)
+
+    setup(max_turn=41, url=full, **kwargs)
+
+    # The flush following the checkpoint of turn 22 is committed before the crash, resuming deletes its rows
+    with pytest.raises(Crash):
+        setup(max_turn=41, url=crashed, on_flush=crash_after(30), workers=workers, **kwargs)
+    assert count(crashed, Transaction) < count(full, Transaction)
+
+    resume(41, url=crashed, checkpoint_every=20)
+    assert dump(crashed) == dump(full)
+
+
+@pytest.fixture(scope='module')
+def sequential(tmp_path_factory):
+    url = f'sqlite:///{tmp_path_factory.mktemp("sequential") / "database.db"}'
+    setup(max_turn=41, n_coins=3, seed=0, engine='numpy', write_mode='bulk', checkpoint_every=20, url=url)
+    return dump(url)
+
+
+@pytest.mark.parametrize('pipelined', [False, True])
+@pytest.mark.parametrize('workers', [None, 1, 2, 3])
+def test_workers_match_sequential_run(tmp_path, sequential, workers, pipelined):
+    url = f'sqlite:///{tmp_path / "database.db"}'
+    setup(max_turn=41, n_coins=3, seed=0, engine='numpy', write_mode='bulk', checkpoint_every=20, url=url,
+          workers=workers, pipelined=pipelined)
+    assert dump(url) == sequential
+
+
+@pytest.mark.parametrize('kwargs', [
+    dict(engine='numpy', write_mode='bulk'),
+    dict(engine='numpy', write_mode='orm'),
+])
+def test_checkpoint_interval_between_flushes(tmp_path, kwargs):
+    # Checkpoints of loop turns 0, 7, 14 and 20, the ones of turns 7 and 14 are not on the flushes every 10 turns
+    url = f'sqlite:///{tmp_path / "database.db"}'
+    setup(max_turn=21, n_coins=2, seed=0, checkpoint_every=7, url=url, **kwargs)
+
+    database = Database(url=url)
+    assert database.checkpoint_turns() == [2, 9, 16, 22]
+    database.engine.dispose()
+
+
+@pytest.mark.parametrize('kwargs', [dict(workers=2), dict(pipelined=True)])
+def test_no_fork_fails_before_clearing(tmp_path, monkeypatch, kwargs):
+    url = f'sqlite:///{tmp_path / "database.db"}'
+    setup(max_turn=11, n_coins=2, seed=0, engine='numpy', write_mode='bulk', url=url)
+    users = count(url, User)
+
+    # Start methods of Windows
+    monkeypatch.setattr(multiprocessing, 'get_all_start_methods', lambda: ['spawn'])
+    with pytest.raises(RuntimeError, match="'fork' start method"):
+        setup(max_turn=11, n_coins=2, seed=0, engine='numpy', write_mode='bulk', url=url, **kwargs)
+    assert count(url, User) == users
@@ -0,0 +1,70 @@
+from BlockSim.simulator.simulator import VectorCointSimulator
+import numpy as np
+
+
+def replay(balances, src, dst, rng):
+    """
+    Applies transactions one at a time, like CointSimulator.commit_transaction(), with the semantics of
+    VectorCointSimulator: sources spend from their balance at the start of the turn, credits are added at the end
+    """
+    keep = src != dst
+    src, dst = src[keep], dst[keep]
+    drain = rng.random(len(src)) < 0.05
+    fraction = rng.random(len(src))
+
+    balances = balances.copy()
+    credits = np.zeros(len(balances))
+    committed = []
+    for s, d, drained, f in zip(src.tolist(), dst.tolist(), drain.tolist(), fraction.tolist()):
+        amount = balances[s] if drained else np.round(f * balances[s], 8)
+        if amount > 0:
+            balances[s] = np.round(balances[s] - amount, 8)
+            credits[d] += amount
+            committed.append((s, d, amount, drained))
+
+    receivers = np.unique([d for _, d, _, _ in committed])
+    balances[receivers] = np.round(balances[receivers] + credits[receivers], 8)
+    return balances, committed
+
+
+def simulator(balances, seed):
+    sim = VectorCointSimulator(seed=seed)
+    sim.add_accounts(np.arange(len(balances)))
+    sim.balances[:] = balances
+    sim.funded.update(np.flatnonzero(sim.balances > 0))
+    return sim
+
+
+def test_commit_transactions_matches_replay():
+    rng = np.random.default_rng(0)
+    balances = np.round(rng.uniform(0, 20, 30), 8)
+    balances[:5] = 0.0
+    src, dst = rng.integers(0, 30, 400), rng.integers(0, 30, 400)
+
+    sim = simulator(balances, seed=1)
+    c_src, c_dst, c_amount = sim.commit_transactions(src, dst)
+    expected, committed = replay(balances, src, dst, np.random.default_rng(1))
+
+    # The draws cover every case: drained sources, self-transfers and sources drawn several times
+    assert any(drained for _, _, _, drained in committed)
+    assert (src == dst).any()
+    assert len(np.unique(src)) < len(src)
+
+    assert list(zip(c_src.tolist(), c_dst.tolist(), c_amount.tolist())) == [(s, d, a) for s, d, a, _ in committed]
+    assert sim.balances.tolist() == expected.tolist()
+    assert sorted(sim.funded) == np.flatnonzero(expected > 0).tolist()
+    assert np.isclose(sim.balances.sum(), balances.sum())
+
+
+def test_commit_transactions_drains_and_skips():
+    # Seed 34 drains the first transfer of account 0, whose next transfers then have nothing to send
+    balances = np.array([10.0, 0.0, 4.0])
+    sim = simulator(balances, seed=34)
+    assert np.random.default_rng(34).random(4)[0] < 0.05
+
+    src, dst, amount = sim.commit_transactions(np.array([0, 1, 1, 0, 0]), np.array([1, 1, 2, 2, 1]))
+
+    # The self-transfer 1 -> 1 is dropped, 1 cannot spend what it receives in the same turn
+    assert list(zip(src.tolist(), dst.tolist(), amount.tolist())) == [(0, 1, 10.0)]
+    assert sim.balances.tolist() == [0.0, 10.0, 4.0]
+    assert sorted(sim.funded) == [1, 2]
@@ -0,0 +1,29 @@
+from BlockSim.orm.database import Database, User
+from BlockSim.orm.writer import BackgroundWriter
+import sqlalchemy as sa
+import pytest
+
+
+def test_writer_writes_every_batch(tmp_path):
+    database = Database(url=f'sqlite:///{tmp_path / "database.db"}')
+
+    with BackgroundWriter(database, max_batches=2) as writer:
+        for start in range(1, 101, 10):
+            writer.put(dict(users=[(u_id,) for u_id in range(start, start + 10)]))
+
+    assert writer.n_rows == 100
+    with database.engine.connect() as connection:
+        assert connection.execute(sa.select(sa.func.count(User.id))).scalar() == 100
+    database.engine.dispose()
+
+
+def test_writer_reports_failures(tmp_path):
+    database = Database(url=f'sqlite:///{tmp_path / "database.db"}')
+
+    writer = BackgroundWriter(database)
+    writer.put(dict(users=[(1,)]))
+    writer.put(dict(users=[(1,)]))
+    writer.put(dict(users=[(2,)]))
+    with pytest.raises(RuntimeError, match='IntegrityError'):
+        writer.close()
+    database.engine.dispose()